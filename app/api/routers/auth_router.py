@@ -105,7 +105,7 @@ async def handle_shopify_callback(
         db_store = await create_or_update_store(db=db, store=store_data)
 
         # 6. Trigger the initial sync
-        initial_sync_store.delay(db_store.id)
+        initial_sync_store.delay(str(db_store.id))
 
         # 7. Redirect to the frontend
         frontend_url = f"http://localhost:3000/shopify-callback?store_id={db_store.id}&shop={shop}"
@@ -1,9 +1,14 @@
 import os
-from typing import Optional, Dict, Any
+from functools import lru_cache
+from typing import Optional, Dict, Any, Iterable, List, Union
 from datetime import datetime, timedelta
 from passlib.context import CryptContext
-from cryptography.fernet import Fernet
-from cryptography.fernet import InvalidToken
+from cryptography.exceptions import InvalidSignature, InvalidTag
+from cryptography.hazmat.primitives import hashes, padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.hmac import HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from jose import jwt, JWTError
 import hashlib
 import hmac
@@ -15,10 +20,32 @@ from app.core.config import get_settings
 
 settings = get_settings()
 
-# Password hashing configuration
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing configuration: new hashes use argon2id (libargon2 via
+# argon2-cffi, OWASP-recommended parameters); existing bcrypt hashes still verify.
+# PASSWORD_HASH_COST (argon2 time cost) and PASSWORD_HASH_MEMORY_COST (KiB) exist
+# so tests can hash cheaply; call get_pwd_context.cache_clear() after changing them
+@lru_cache(maxsize=1)
+def get_pwd_context() -> CryptContext:
+    return CryptContext(
+        schemes=["argon2", "bcrypt"],
+        deprecated="auto",
+        argon2__type="ID",
+        argon2__time_cost=int(os.getenv("PASSWORD_HASH_COST", "2")),
+        argon2__memory_cost=int(os.getenv("PASSWORD_HASH_MEMORY_COST", "19456")),
+        argon2__parallelism=1,
+    )
 
 # Token encryption configuration
+# Tokens are AES-256-GCM: version (0x81) | nonce (12) | ciphertext | tag (16),
+# urlsafe-base64 encoded at the storage boundary. Tokens written before the switch
+# are Fernet (version 0x80) and still decrypt.
+# The key and the ciphers derived from it are resolved once per process; tests that
+# change ENCRYPTION_KEY must clear the get_encryption_key, get_token_cipher and
+# get_fernet_keys caches
+_TOKEN_VERSION = 0x81
+_FERNET_VERSION = 0x80
+
+@lru_cache(maxsize=1)
 def get_encryption_key() -> bytes:
     key = os.getenv("ENCRYPTION_KEY")
     if not key:
@@ -30,60 +57,150 @@ def get_encryption_key() -> bytes:
     except Exception as e:
         raise ValueError(f"Invalid encryption key: {str(e)}")
 
-def get_fernet() -> Fernet:
-    return Fernet(get_encryption_key())
+@lru_cache(maxsize=1)
+def get_token_cipher() -> AESGCM:
+    """AES-256-GCM keyed with a subkey derived (HKDF-SHA256) from the encryption key."""
+    key = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b"fastmart token encryption"
+    ).derive(base64.urlsafe_b64decode(get_encryption_key()))
+    return AESGCM(key)
+
+@lru_cache(maxsize=1)
+def get_fernet_keys() -> tuple:
+    """Split the Fernet key into its (signing, encryption) AES-128 halves, for legacy tokens."""
+    key = base64.urlsafe_b64decode(get_encryption_key())
+    return key[:16], key[16:]
 
 def hash_password(password: str) -> str:
     """
-    Hash a password using bcrypt.
+    Hash a password using argon2id.
     """
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
     Verify a password against its hash.
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 def encrypt_token(token: str) -> str:
     """
-    Encrypt a token using Fernet symmetric encryption.
-    Returns the encrypted token as a base64-encoded string.
+    Encrypt a token using AES-256-GCM.
+    Returns the encrypted token as a urlsafe base64-encoded string.
     """
     if not token:
         return ""
-    
-    f = get_fernet()
-    encrypted_bytes = f.encrypt(token.encode())
-    return encrypted_bytes.decode()
+
+    return base64.urlsafe_b64encode(encrypt_token_raw(token)).decode()
+
+def _seal(cipher: AESGCM, plaintext: bytes) -> bytes:
+    nonce = os.urandom(12)
+    return bytes((_TOKEN_VERSION,)) + nonce + cipher.encrypt(nonce, plaintext, None)
+
+def encrypt_token_raw(token: Union[str, bytes]) -> bytes:
+    """
+    Encrypt a token into raw bytes (version | nonce | ciphertext | tag), for storage
+    that holds bytes; encrypt_token returns its base64 encoding. decrypt_token
+    accepts either form. Bytes tokens are encrypted as-is, with no str round trip.
+    """
+    if not token:
+        return b""
+
+    return _seal(get_token_cipher(), token if isinstance(token, bytes) else token.encode())
+
+def _is_fernet_token(raw_token: bytes) -> bool:
+    """Check the framing of a raw Fernet token without touching any key material."""
+    # version (1) + timestamp (8) + IV (16) + whole AES blocks (>= 1 x 16) + HMAC (32)
+    return (
+        len(raw_token) >= 73
+        and (len(raw_token) - 57) % 16 == 0
+        and raw_token[0] == _FERNET_VERSION
+    )
+
+def _decrypt_fernet_raw(raw_token: bytes) -> Optional[bytes]:
+    """Decrypt a well-framed raw legacy Fernet token; None if it is invalid."""
+    signing_key, encryption_key = get_fernet_keys()
+    h = HMAC(signing_key, hashes.SHA256())
+    h.update(raw_token[:-32])
+    try:
+        h.verify(raw_token[-32:])
+    except InvalidSignature:
+        return None
+    decryptor = Cipher(algorithms.AES(encryption_key), modes.CBC(raw_token[9:25])).decryptor()
+    unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+    try:
+        padded = decryptor.update(raw_token[25:-32]) + decryptor.finalize()
+        return unpadder.update(padded) + unpadder.finalize()
+    except ValueError:
+        return None
+
+def decrypt_token_raw(raw_token: bytes) -> Optional[bytes]:
+    """
+    Decrypt a raw token from encrypt_token_raw (or a raw legacy Fernet token) into
+    the plaintext bytes. Returns None if the token is empty or invalid.
+    """
+    if not raw_token:
+        return None
+    # Malformed input is rejected on its framing, before any key or cipher work
+    if raw_token[0] == _TOKEN_VERSION:
+        # version (1) + nonce (12) + tag (16)
+        if len(raw_token) < 29:
+            return None
+        try:
+            return get_token_cipher().decrypt(raw_token[1:13], raw_token[13:], None)
+        except InvalidTag:
+            return None
+    if _is_fernet_token(raw_token):
+        return _decrypt_fernet_raw(raw_token)
+    return None
 
 def decrypt_token(encrypted_token: str) -> Optional[str]:
     """
-    Decrypt a token using Fernet symmetric encryption.
+    Decrypt a token from encrypt_token, or a legacy Fernet token.
+    Accepts the base64 form and raw tokens from encrypt_token_raw.
     Returns the decrypted token as a string, or None if decryption fails.
     """
     if not encrypted_token:
         return None
-    
+
+    if isinstance(encrypted_token, bytes) and encrypted_token[0] in (_TOKEN_VERSION, _FERNET_VERSION):
+        # Raw token: base64 text never starts with a version byte
+        raw_token = encrypted_token
+    else:
+        if not isinstance(encrypted_token, bytes):
+            # It's a str, a SQLAlchemy attribute or other object
+            encrypted_token = str(encrypted_token)
+        try:
+            raw_token = base64.urlsafe_b64decode(encrypted_token)
+        except ValueError:
+            return None
+
+    decrypted = decrypt_token_raw(raw_token)
     try:
-        f = get_fernet()
-        # Convert to string if it's not already a string
-        if hasattr(encrypted_token, 'decode'):
-            # It's bytes
-            token_str = encrypted_token.decode()
-        elif hasattr(encrypted_token, '__str__'):
-            # It's a SQLAlchemy attribute or other object
-            token_str = str(encrypted_token)
-        else:
-            token_str = encrypted_token
-            
-        # Now encode for decryption
-        decrypted_bytes = f.decrypt(token_str.encode())
-        return decrypted_bytes.decode()
-    except InvalidToken:
+        return decrypted.decode() if decrypted is not None else None
+    except UnicodeDecodeError:
         return None
-    except Exception as e:
-        raise ValueError(f"Error decrypting token: {str(e)}")
+
+def encrypt_tokens(tokens: Iterable[Optional[str]]) -> List[str]:
+    """
+    Encrypt many tokens with one cipher lookup (e.g. when rotating stored tokens).
+    Same per-token result as encrypt_token: empty/None tokens become "".
+    """
+    cipher = get_token_cipher()
+    return [
+        base64.urlsafe_b64encode(_seal(cipher, token.encode())).decode() if token else ""
+        for token in tokens
+    ]
+
+def decrypt_tokens(encrypted_tokens: Iterable) -> List[Optional[str]]:
+    """
+    Decrypt many tokens, e.g. to re-encrypt legacy Fernet tokens with encrypt_tokens.
+    Same per-token result as decrypt_token: None for empty or invalid tokens.
+    """
+    return [decrypt_token(encrypted_token) for encrypted_token in encrypted_tokens]
 
 def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
     """
@@ -1,13 +1,37 @@
+import orjson
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import declarative_base, sessionmaker
 from app.core.config import get_settings
 
 settings = get_settings()
 
+
+def json_serializer(value) -> str:
+    """Serialize JSON/JSONB bind values with orjson (SQLAlchemy expects a str)."""
+    return orjson.dumps(value).decode()
+
+
 engine = create_async_engine(
     settings.DATABASE_URL,
     echo=False,
-    future=True
+    future=True,
+    json_serializer=json_serializer,
+    json_deserializer=orjson.loads,
+    # Sized for the Celery sync tasks, which run several sessions per store concurrently
+    pool_size=20,
+    max_overflow=10,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    connect_args={
+        # asyncpg's server-side statement cache and SQLAlchemy's prepared statement cache
+        "statement_cache_size": 1024,
+        "prepared_statement_cache_size": 1024,
+        "server_settings": {
+            "application_name": "fastmart",
+            # JIT compilation only slows down the short OLTP statements issued here
+            "jit": "off",
+        },
+    }
 )
 
 AsyncSessionLocal = sessionmaker(
@@ -19,8 +43,5 @@ AsyncSessionLocal = sessionmaker(
 Base = declarative_base()
 
 async def get_db():
-    session = AsyncSessionLocal()
-    try:
-        yield session
-    finally:
-        await session.close() 
\ No newline at end of file
+    async with AsyncSessionLocal() as session:
+        yield session 
\ No newline at end of file
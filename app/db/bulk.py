@@ -0,0 +1,174 @@
+from typing import Dict, List, Sequence
+from sqlalchemy import Table
+from sqlalchemy.dialects.postgresql import JSON, JSONB
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.base import json_serializer
+
+# Upsert SQL generated per (table, columns, conflict/update columns)
+_UPSERT_SQL: Dict[tuple, str] = {}
+
+
+async def get_driver_connection(session: AsyncSession):
+    """Return the asyncpg connection backing the session's current transaction."""
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    driver_connection = raw_connection.driver_connection
+    if not driver_connection.is_in_transaction():
+        # SQLAlchemy opens the driver-level transaction lazily, on the first
+        # statement; raw calls made before that would run outside of it.
+        await connection.exec_driver_sql("SELECT 1")
+    return driver_connection
+
+
+def _encode_values(table: Table, columns: Sequence[str], row: Dict) -> tuple:
+    """Order a row's values by `columns`, serializing JSON/JSONB values for the driver."""
+    return tuple(
+        json_serializer(row.get(c))
+        if row.get(c) is not None and isinstance(table.c[c].type, (JSON, JSONB))
+        else row.get(c)
+        for c in columns
+    )
+
+
+def _scalar_defaults(table: Table) -> Dict:
+    """Python-side scalar defaults of `table`'s NOT NULL columns, which COPY bypasses."""
+    return {
+        c.name: c.default.arg
+        for c in table.c
+        if c.default is not None and c.default.is_scalar and not c.nullable
+    }
+
+
+def _on_conflict_clause(conflict_cols: Sequence[str], update_cols: Sequence[str]) -> str:
+    if update_cols:
+        action = "DO UPDATE SET " + ", ".join(f"{c} = EXCLUDED.{c}" for c in update_cols)
+    else:
+        action = "DO NOTHING"
+    return f"ON CONFLICT ({', '.join(conflict_cols)}) {action}"
+
+
+def _upsert_sql(
+    table: Table,
+    columns: Sequence[str],
+    conflict_cols: Sequence[str],
+    update_cols: Sequence[str]
+) -> str:
+    """Build (once per row shape) a positional INSERT ... ON CONFLICT statement for asyncpg."""
+    key = (table.name, tuple(columns), tuple(conflict_cols), tuple(update_cols))
+    sql = _UPSERT_SQL.get(key)
+    if sql is None:
+        placeholders = ", ".join(f"${i}" for i in range(1, len(columns) + 1))
+        sql = (
+            f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES ({placeholders}) "
+            f"{_on_conflict_clause(conflict_cols, update_cols)}"
+        )
+        _UPSERT_SQL[key] = sql
+    return sql
+
+
+async def upsert_many(
+    session: AsyncSession,
+    table: Table,
+    rows: List[Dict],
+    conflict_cols: Sequence[str],
+    update_cols: Sequence[str]
+) -> None:
+    """
+    Upsert rows sharing one shape with a single asyncpg executemany.
+
+    The first row fixes the column order; the SQL is built once per shape and
+    the rows are bound positionally, without SQLAlchemy compilation or
+    parameter processing. Suited to small batches where a COPY staging table
+    (see bulk_upsert) costs more than it saves.
+    """
+    if not rows:
+        return
+    columns = list(rows[0])
+    sql = _upsert_sql(table, columns, conflict_cols, update_cols)
+    driver_connection = await get_driver_connection(session)
+    await driver_connection.executemany(sql, [_encode_values(table, columns, row) for row in rows])
+
+
+async def bulk_upsert(
+    session: AsyncSession,
+    table: Table,
+    rows: List[Dict],
+    conflict_cols: Sequence[str],
+    update_cols: Sequence[str],
+    returning: Sequence[str] = ('id',)
+) -> List:
+    """
+    Upsert many rows with a single COPY and a single INSERT ... ON CONFLICT.
+
+    The rows are copied into a temporary staging table (created once per
+    transaction, dropped on commit) and merged into `table`. Rows sharing a
+    conflict key are collapsed, last one wins, since Postgres refuses to update
+    the same row twice in one statement.
+
+    Returns the `returning` columns of every inserted/updated row as asyncpg
+    records, or an empty list when `returning` is empty.
+    """
+    if not rows:
+        return []
+
+    unique_rows = {tuple(row[c] for c in conflict_cols): row for row in rows}
+    columns = list(rows[0].keys())
+    records = [_encode_values(table, columns, row) for row in unique_rows.values()]
+
+    stage = f"stage_{table.name}"
+    column_list = ", ".join(columns)
+    driver_connection = await get_driver_connection(session)
+    # Without arguments asyncpg uses the simple query protocol, which sends both
+    # statements in one round trip; the stage is emptied before use rather than after
+    await driver_connection.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS {stage} (LIKE {table.name} INCLUDING DEFAULTS) ON COMMIT DROP; "
+        f"TRUNCATE {stage}"
+    )
+    await driver_connection.copy_records_to_table(stage, records=records, columns=columns)
+
+    merge = (
+        f"INSERT INTO {table.name} ({column_list}) SELECT {column_list} FROM {stage} "
+        f"{_on_conflict_clause(conflict_cols, update_cols)}"
+    )
+    if returning:
+        result = await driver_connection.fetch(f"{merge} RETURNING {', '.join(returning)}")
+    else:
+        await driver_connection.execute(merge)
+        result = []
+    return result
+
+
+async def replace_rows(
+    session: AsyncSession,
+    table: Table,
+    key_col: str,
+    keys: Sequence,
+    rows: List[Dict],
+    unique_cols: Sequence[str]
+) -> None:
+    """
+    Replace every row of `table` whose `key_col` is in `keys` with `rows`.
+
+    For child rows that are always rewritten wholesale (e.g. an order's line
+    items): one DELETE ... WHERE key_col = ANY($1) and one COPY straight into
+    `table`, with no staging table or conflict handling. Rows sharing
+    `unique_cols` are collapsed first, last one wins. Missing or None values
+    of NOT NULL columns get the column's Python default, as an ORM insert would.
+    """
+    if not keys:
+        return
+    driver_connection = await get_driver_connection(session)
+    await driver_connection.execute(f"DELETE FROM {table.name} WHERE {key_col} = ANY($1)", list(keys))
+    if not rows:
+        return
+    defaults = _scalar_defaults(table)
+    unique_rows = {
+        tuple(row[c] for c in unique_cols): {**row, **{c: v for c, v in defaults.items() if row.get(c) is None}}
+        for row in rows
+    }
+    columns = list(rows[0].keys()) + [c for c in defaults if c not in rows[0]]
+    await driver_connection.copy_records_to_table(
+        table.name,
+        records=[_encode_values(table, columns, row) for row in unique_rows.values()],
+        columns=columns
+    )
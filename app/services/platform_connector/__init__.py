@@ -1,3 +1,4 @@
+from functools import lru_cache
 from typing import Dict
 from .base import EcommercePlatformConnector
 from .shopify import ShopifyConnector
@@ -7,10 +8,15 @@ _connectors: Dict[str, EcommercePlatformConnector] = {
     'shopify': ShopifyConnector()
 }
 
+@lru_cache(maxsize=8)
 def get_connector(platform: str) -> EcommercePlatformConnector:
     """
     Get a connector instance for the specified platform.
     
+    Results are memoized per platform string, so the same instance is shared by
+    every caller (and every sync stream): connectors must be stateless or hold
+    only reentrant state.
+    
     Args:
         platform: The platform name (e.g., 'shopify')
         
@@ -39,6 +39,21 @@ class EcommercePlatformConnector(ABC):
         """Fetch orders from the platform."""
         pass
     
+    async def fetch_orders_concurrent(
+        self, 
+        access_token: str, 
+        shop_domain: str, 
+        since: Optional[datetime] = None, 
+        limit: int = 250,
+        prefetch: int = 2
+    ) -> List[Dict]:
+        """Fetch orders with up to `prefetch` pages fetched ahead of the caller.
+
+        Defaults to the sequential fetch_orders for platforms without cursor prefetching.
+        """
+        async for batch in self.fetch_orders(access_token, shop_domain, since=since, limit=limit):
+            yield batch
+    
     @abstractmethod
     async def fetch_products(
         self, 
@@ -50,6 +65,21 @@ class EcommercePlatformConnector(ABC):
         """Fetch products from the platform."""
         pass
     
+    async def fetch_products_concurrent(
+        self, 
+        access_token: str, 
+        shop_domain: str, 
+        since: Optional[datetime] = None, 
+        limit: int = 250,
+        prefetch: int = 2
+    ) -> List[Dict]:
+        """Fetch products with up to `prefetch` pages fetched ahead of the caller.
+
+        Defaults to the sequential fetch_products for platforms without cursor prefetching.
+        """
+        async for batch in self.fetch_products(access_token, shop_domain, since=since, limit=limit):
+            yield batch
+    
     @abstractmethod
     async def fetch_customers(
         self, 
@@ -61,8 +91,22 @@ class EcommercePlatformConnector(ABC):
         """Fetch customers from the platform."""
         pass
     
+    async def fetch_customers_simple(
+        self, 
+        access_token: str, 
+        shop_domain: str, 
+        since: Optional[datetime] = None, 
+        limit: int = 250
+    ) -> List[Dict]:
+        """Fetch customers through the platform's regular (non-bulk) paginated API.
+
+        Defaults to fetch_customers for platforms without a separate query API.
+        """
+        async for batch in self.fetch_customers(access_token, shop_domain, since=since, limit=limit):
+            yield batch
+    
     @abstractmethod
-    async def map_order_to_db_model(
+    def map_order_to_db_model(
         self, 
         platform_order_data: Dict, 
         store_id: uuid.UUID
@@ -71,7 +115,7 @@ class EcommercePlatformConnector(ABC):
         pass
     
     @abstractmethod
-    async def map_product_to_db_model(
+    def map_product_to_db_model(
         self, 
         platform_product_data: Dict, 
         store_id: uuid.UUID
@@ -80,7 +124,7 @@ class EcommercePlatformConnector(ABC):
         pass
     
     @abstractmethod
-    async def map_customer_to_db_model(
+    def map_customer_to_db_model(
         self, 
         platform_customer_data: Dict, 
         store_id: uuid.UUID
@@ -1,5 +1,8 @@
+import asyncio
+import json
 import os
 import time
+import urllib.error
 from typing import Dict, List, Optional, Any
 from datetime import datetime, timezone
 from decimal import Decimal
@@ -7,6 +10,7 @@ import shopify
 from dotenv import load_dotenv
 from shopify import ShopifyResource
 from shopify.collection import PaginatedCollection
+from pyactiveresource.connection import ClientError
 
 from .base import EcommercePlatformConnector
 from app.core.security import decrypt_token,create_secure_state
@@ -47,6 +51,42 @@ def retry_on_rate_limit(max_retries=3, delay=5):
         return wrapper
     return decorator
 
+def _with_rest_rate_limit_retry(request, max_retries=5, backoff=1.0):
+    """Run one blocking Shopify REST request, retrying only that request on HTTP 429.
+
+    Runs in a worker thread, so sleeping blocks nothing else. Waits for the
+    Retry-After header when Shopify sends one, otherwise backs off exponentially.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return request()
+        except ClientError as e:
+            if e.code != 429 or attempt == max_retries:
+                raise
+            retry_after = e.response.get('Retry-After') or e.response.get('retry-after')
+            delay = float(retry_after) if retry_after else backoff * 2 ** attempt
+            logging.warning(f"Shopify REST rate limit hit, retrying in {delay:.1f}s ({attempt + 1}/{max_retries})")
+            time.sleep(delay)
+
+CUSTOMERS_QUERY = """
+query Customers($first: Int!, $after: String, $query: String) {
+  customers(first: $first, after: $after, query: $query) {
+    pageInfo { hasNextPage endCursor }
+    nodes {
+      legacyResourceId
+      email
+      firstName
+      lastName
+      numberOfOrders
+      amountSpent { amount }
+      createdAt
+      updatedAt
+      tags
+    }
+  }
+}
+"""
+
 class ShopifyConnector(EcommercePlatformConnector):
     """Shopify platform connector implementation."""
 
@@ -98,14 +138,17 @@ class ShopifyConnector(EcommercePlatformConnector):
             # Catch other potential errors (network issues, etc.)
             raise Exception(f"Failed to exchange code for token (General Error): {str(e)}")
 
-    async def get_api_client(self, access_token: str, shop_domain: str) -> shopify:
-        """Get and activate a Shopify API client instance."""
+    def _create_session(self, access_token: str, shop_domain: str) -> shopify.Session:
+        """Build a Shopify session from the stored (encrypted) access token."""
         decrypted_token = decrypt_token(access_token) # Use the decrypted token
         if not decrypted_token:
             raise ValueError("Invalid or missing access token after decryption.")
+        return shopify.Session(shop_domain, self.API_VERSION, decrypted_token)
 
+    async def get_api_client(self, access_token: str, shop_domain: str) -> shopify:
+        """Get and activate a Shopify API client instance."""
+        session = self._create_session(access_token, shop_domain)
         try:
-            session = shopify.Session(shop_domain,self.API_VERSION ,decrypted_token)
             shopify.ShopifyResource.activate_session(session)
             return shopify
         except ValueError as e:
@@ -113,6 +156,73 @@ class ShopifyConnector(EcommercePlatformConnector):
         except Exception as e:
             raise Exception(f"Failed to initialize Shopify client: {str(e)}")
 
+    def _fetch_page(self, session: shopify.Session, resource_name: str, previous_page: Optional[PaginatedCollection] = None, **params):
+        """Fetch a single page of a resource (blocking).
+
+        Runs in a worker thread, so the session is activated for the current thread:
+        the Shopify client keeps its site and auth headers in thread-local storage.
+        """
+        shopify.ShopifyResource.activate_session(session)
+        try:
+            if previous_page is None:
+                page = _with_rest_rate_limit_retry(lambda: getattr(shopify, resource_name).find(**params))
+            else:
+                page = _with_rest_rate_limit_retry(previous_page.next_page)
+            return page, [resource.to_dict() for resource in page]
+        finally:
+            shopify.ShopifyResource.clear_session()
+
+    async def _fetch_pages_concurrent(
+        self,
+        resource_name: str,
+        access_token: str,
+        shop_domain: str,
+        since: Optional[datetime] = None,
+        limit: int = 250,
+        prefetch: int = 2,
+        **kwargs
+    ):
+        """Yield pages of a resource while the following pages are fetched in the background.
+
+        Cursor pagination only reveals the next page_info once the current page has
+        arrived, so pages are requested one at a time, in order, each in a worker
+        thread; up to `prefetch` pages are buffered ahead of the consumer.
+        """
+        session = self._create_session(access_token, shop_domain)
+        params = {'limit': min(limit, 250)} # Shopify max limit is 250
+        if since:
+            params['updated_at_min'] = since.isoformat()
+        params.update(kwargs)
+
+        pages: asyncio.Queue = asyncio.Queue(maxsize=prefetch)
+        done = object()
+
+        async def produce():
+            try:
+                page = None
+                while True:
+                    page, page_data = await asyncio.to_thread(self._fetch_page, session, resource_name, page, **params)
+                    if page_data:
+                        await pages.put(page_data)
+                    if not page.has_next_page():
+                        break
+                await pages.put(done)
+            except Exception as e:
+                logging.error(f"Error fetching {resource_name} pages for {shop_domain}: {e}")
+                await pages.put(e)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                item = await pages.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            producer.cancel()
+
     @retry_on_rate_limit()
     async def _fetch_all_resources(self, resource_class: ShopifyResource, since: Optional[datetime] = None, limit: int = 50, **kwargs) -> List[Dict]:
         """Generic method to fetch all pages of a resource."""
@@ -177,6 +287,26 @@ class ShopifyConnector(EcommercePlatformConnector):
             client.ShopifyResource.clear_session()
             # print(f"Shopify session cleared for {shop_domain}") # Debugging
 
+    async def fetch_orders_concurrent(
+        self,
+        access_token: str,
+        shop_domain: str,
+        since: Optional[datetime] = None,
+        limit: int = 250,
+        prefetch: int = 2
+    ) -> List[Dict]:
+        """Fetch orders page by page, prefetching the next pages while the caller processes the current one."""
+        async for page in self._fetch_pages_concurrent(
+            'Order',
+            access_token,
+            shop_domain,
+            since=since,
+            limit=limit,
+            prefetch=prefetch,
+            status='any' # Fetch all orders regardless of status
+        ):
+            yield page
+
     async def fetch_products(
         self,
         access_token: str,
@@ -201,6 +331,25 @@ class ShopifyConnector(EcommercePlatformConnector):
         finally:
             client.ShopifyResource.clear_session()
 
+    async def fetch_products_concurrent(
+        self,
+        access_token: str,
+        shop_domain: str,
+        since: Optional[datetime] = None,
+        limit: int = 250,
+        prefetch: int = 2
+    ) -> List[Dict]:
+        """Fetch products page by page, prefetching the next pages while the caller processes the current one."""
+        async for page in self._fetch_pages_concurrent(
+            'Product',
+            access_token,
+            shop_domain,
+            since=since,
+            limit=limit,
+            prefetch=prefetch
+        ):
+            yield page
+
     async def fetch_customers(
         self,
         access_token: str,
@@ -226,6 +375,97 @@ class ShopifyConnector(EcommercePlatformConnector):
         finally:
             client.ShopifyResource.clear_session()
             
+    def _execute_graphql(self, session: shopify.Session, query: str, variables: Optional[Dict] = None, max_retries: int = 5, backoff: float = 1.0) -> Dict:
+        """Run a GraphQL Admin API query (blocking) and return its decoded response.
+
+        THROTTLED responses are retried after the delay their cost telemetry asks
+        for (see _throttle_delay), HTTP 429 and 5xx errors after Retry-After or an
+        exponential backoff. Runs in a worker thread, so sleeping blocks nothing else.
+        """
+        for attempt in range(max_retries + 1):
+            shopify.ShopifyResource.activate_session(session)
+            try:
+                response = json.loads(shopify.GraphQL().execute(query, variables=variables))
+            except urllib.error.HTTPError as e:
+                if (e.code != 429 and e.code < 500) or attempt == max_retries:
+                    raise
+                retry_after = e.headers.get('Retry-After') if e.headers else None
+                delay = float(retry_after) if retry_after else backoff * 2 ** attempt
+            else:
+                errors = response.get('errors')
+                if not errors:
+                    return response
+                throttled = isinstance(errors, list) and any(
+                    isinstance(error, dict) and error.get('extensions', {}).get('code') == 'THROTTLED' for error in errors
+                )
+                if not throttled or attempt == max_retries:
+                    raise Exception(f"Shopify GraphQL query failed: {errors}")
+                delay = self._throttle_delay(response) or backoff * 2 ** attempt
+            finally:
+                shopify.ShopifyResource.clear_session()
+            logging.warning(f"Shopify GraphQL query throttled, retrying in {delay:.1f}s ({attempt + 1}/{max_retries})")
+            time.sleep(delay)
+
+    @staticmethod
+    def _throttle_delay(response: Dict) -> float:
+        """Seconds to wait before the next query, from the cost telemetry of the last one."""
+        cost = response.get('extensions', {}).get('cost')
+        if not cost:
+            return 0.0
+        status = cost['throttleStatus']
+        shortfall = cost['requestedQueryCost'] - status['currentlyAvailable']
+        if shortfall <= 0:
+            return 0.0
+        return shortfall / status['restoreRate']
+
+    @staticmethod
+    def _graphql_customer_to_rest(node: Dict) -> Dict:
+        """Reshape a GraphQL customer node like the REST payload map_customer_to_db_model expects."""
+        return {
+            'id': node['legacyResourceId'],
+            'email': node.get('email'),
+            'first_name': node.get('firstName'),
+            'last_name': node.get('lastName'),
+            'orders_count': int(node.get('numberOfOrders') or 0),
+            'total_spent': (node.get('amountSpent') or {}).get('amount'),
+            'created_at': node.get('createdAt'),
+            'updated_at': node.get('updatedAt'),
+            'tags': ', '.join(node.get('tags') or []),
+        }
+
+    async def fetch_customers_simple(
+        self,
+        access_token: str,
+        shop_domain: str,
+        since: Optional[datetime] = None,
+        limit: int = 250
+    ) -> List[Dict]:
+        """Fetch customers with standard cursor-paginated GraphQL queries.
+
+        Requests are paced by the query cost telemetry Shopify returns with every
+        response.
+        """
+        session = self._create_session(access_token, shop_domain)
+        variables = {'first': min(limit, 250), 'after': None, 'query': None}
+        if since:
+            variables['query'] = f"updated_at:>='{since.isoformat()}'"
+
+        while True:
+            try:
+                response = await asyncio.to_thread(self._execute_graphql, session, CUSTOMERS_QUERY, variables)
+            except Exception as e:
+                logging.error(f"Error fetching Shopify customers for {shop_domain}: {e}")
+                raise
+            connection = response['data']['customers']
+            if connection['nodes']:
+                yield [self._graphql_customer_to_rest(node) for node in connection['nodes']]
+            if not connection['pageInfo']['hasNextPage']:
+                break
+            variables['after'] = connection['pageInfo']['endCursor']
+            delay = self._throttle_delay(response)
+            if delay:
+                await asyncio.sleep(delay)
+
     async def fetch_inventory_levels(
         self,
         access_token: str,
@@ -280,6 +520,28 @@ class ShopifyConnector(EcommercePlatformConnector):
         finally:
             client.ShopifyResource.clear_session()
 
+    def _find_resource(self, session: shopify.Session, resource_name: str, resource_id: str) -> Dict:
+        """Fetch a single resource by ID (blocking); runs in a worker thread like _fetch_page."""
+        shopify.ShopifyResource.activate_session(session)
+        try:
+            return _with_rest_rate_limit_retry(lambda: getattr(shopify, resource_name).find(resource_id)).to_dict()
+        finally:
+            shopify.ShopifyResource.clear_session()
+
+    async def fetch_products_by_ids(self, access_token: str, shop_domain: str, platform_product_ids: List[str]):
+        """Yield (platform_product_id, product data or exception) for each ID, fetched one by one in a worker thread.
+
+        Failures are yielded rather than raised, so callers can skip a product and go on.
+        """
+        session = self._create_session(access_token, shop_domain)
+        for platform_product_id in platform_product_ids:
+            try:
+                product = await asyncio.to_thread(self._find_resource, session, 'Product', platform_product_id)
+            except Exception as e:
+                yield platform_product_id, e
+            else:
+                yield platform_product_id, product
+
     def _parse_datetime(self, value: Optional[str]) -> Optional[datetime]:
         """Safely parse ISO 8601 datetime strings from Shopify."""
         if not value:
@@ -305,14 +567,15 @@ class ShopifyConnector(EcommercePlatformConnector):
              print(f"Warning: Could not convert value to Decimal: {value}")
              return Decimal('0.00')
 
-    async def map_order_to_db_model(
+    def map_order_to_db_model(
         self,
         platform_order_data: Dict,
         # store_id: uuid.UUID # store_id is handled by the caller/sync process
     ) -> Dict:
         """Transform Shopify order data into our database model format (excluding IDs)."""
+        get = platform_order_data.get
         # Extract and process discount applications for analytics
-        discount_applications = platform_order_data.get('discount_applications', [])
+        discount_applications = get('discount_applications', [])
         # Ensure we capture all relevant discount data
         processed_discounts = []
         for discount in discount_applications:
@@ -329,108 +592,112 @@ class ShopifyConnector(EcommercePlatformConnector):
             processed_discounts.append(processed_discount)
             
         return {
-            'platform_order_id': str(platform_order_data.get('id')),
-            'order_number': str(platform_order_data.get('order_number')),
-            'total_price': self._safe_decimal(platform_order_data.get('total_price')),
-            'currency': platform_order_data.get('currency'),
-            'financial_status': platform_order_data.get('financial_status'),
-            'fulfillment_status': platform_order_data.get('fulfillment_status'), # Note: might be None
-            'processed_at': self._parse_datetime(platform_order_data.get('processed_at')),
-            'platform_created_at': self._parse_datetime(platform_order_data.get('created_at')),
-            'platform_updated_at': self._parse_datetime(platform_order_data.get('updated_at')),
+            'platform_order_id': str(get('id')),
+            'order_number': str(get('order_number')),
+            'total_price': self._safe_decimal(get('total_price')),
+            'currency': get('currency'),
+            'financial_status': get('financial_status'),
+            'fulfillment_status': get('fulfillment_status'), # Note: might be None
+            'processed_at': self._parse_datetime(get('processed_at')),
+            'platform_created_at': self._parse_datetime(get('created_at')),
+            'platform_updated_at': self._parse_datetime(get('updated_at')),
             # 'customer_id' needs to be looked up based on platform_customer_id
-            'platform_customer_id': str(platform_order_data.get('customer', {}).get('id')) if platform_order_data.get('customer') else None,
+            'platform_customer_id': str(get('customer', {}).get('id')) if get('customer') else None,
             # Store processed discount applications for analytics
             'discount_applications': processed_discounts,
-            'cancelled_at': self._parse_datetime(platform_order_data.get('cancelled_at')),
+            'cancelled_at': self._parse_datetime(get('cancelled_at')),
             # Line items need separate mapping and linking
-            # 'line_items': platform_order_data.get('line_items', [])
+            # 'line_items': get('line_items', [])
         }
 
-    async def map_product_to_db_model(
+    def map_product_to_db_model(
         self,
         platform_product_data: Dict,
     ) -> Dict:
         """Transform Shopify product data into our database model format (excluding IDs)."""
+        get = platform_product_data.get
         return {
-            'platform_product_id': str(platform_product_data.get('id')),
-            'title': platform_product_data.get('title'),
-            'vendor': platform_product_data.get('vendor'),
-            'product_type': platform_product_data.get('product_type'),
-            'platform_created_at': self._parse_datetime(platform_product_data.get('created_at')),
-            'platform_updated_at': self._parse_datetime(platform_product_data.get('updated_at')),
+            'platform_product_id': str(get('id')),
+            'title': get('title'),
+            'vendor': get('vendor'),
+            'product_type': get('product_type'),
+            'platform_created_at': self._parse_datetime(get('created_at')),
+            'platform_updated_at': self._parse_datetime(get('updated_at')),
             # Variants might need separate handling if storing variant-level details
-            'variants': platform_product_data.get('variants', []) # Include variants for potential line item mapping
+            'variants': get('variants', []) # Include variants for potential line item mapping
         }
 
-    async def map_customer_to_db_model(
+    def map_customer_to_db_model(
         self,
         platform_customer_data: Dict,
     ) -> Dict:
         """Transform Shopify customer data into our database model format (excluding IDs)."""
+        get = platform_customer_data.get
         return {
-            'platform_customer_id': str(platform_customer_data.get('id')),
-            'email': platform_customer_data.get('email'),
-            'first_name': platform_customer_data.get('first_name'),
-            'last_name': platform_customer_data.get('last_name'),
-            'orders_count': int(platform_customer_data.get('orders_count', 0)),
-            'total_spent': self._safe_decimal(platform_customer_data.get('total_spent')),
-            'platform_created_at': self._parse_datetime(platform_customer_data.get('created_at')),
-            'platform_updated_at': self._parse_datetime(platform_customer_data.get('updated_at')),
-            'tags': platform_customer_data.get('tags', '').split(',') if platform_customer_data.get('tags') else [],
+            'platform_customer_id': str(get('id')),
+            'email': get('email'),
+            'first_name': get('first_name'),
+            'last_name': get('last_name'),
+            'orders_count': int(get('orders_count', 0)),
+            'total_spent': self._safe_decimal(get('total_spent')),
+            'platform_created_at': self._parse_datetime(get('created_at')),
+            'platform_updated_at': self._parse_datetime(get('updated_at')),
+            'tags': get('tags', '').split(',') if get('tags') else [],
         }
-    async def map_product_variant_to_db_model(
+    def map_product_variant_to_db_model(
         self,
         platform_variant_data: Dict,
         # product_id: uuid.UUID # product_id is handled by the caller/sync process
     ) -> Dict:
         """Transform Shopify product variant data into our database model format (excluding IDs)."""
+        get = platform_variant_data.get
         return {
-            'platform_variant_id': str(platform_variant_data.get('id')),
-            'title': platform_variant_data.get('title'),
-            'sku': platform_variant_data.get('sku'),
-            'price': self._safe_decimal(platform_variant_data.get('price')),
-            'compare_at_price': self._safe_decimal(platform_variant_data.get('compare_at_price')),
-            'position': int(platform_variant_data.get('position', 1)),
-            'inventory_item_id': str(platform_variant_data.get('inventory_item_id')) if platform_variant_data.get('inventory_item_id') else None,
-            'inventory_quantity': int(platform_variant_data.get('inventory_quantity', 0)),
-            'weight': self._safe_decimal(platform_variant_data.get('weight')),
-            'weight_unit': platform_variant_data.get('weight_unit'),
-            'option1': platform_variant_data.get('option1'),
-            'option2': platform_variant_data.get('option2'),
-            'option3': platform_variant_data.get('option3'),
-            'taxable': platform_variant_data.get('taxable', True),
-            'barcode': platform_variant_data.get('barcode'),
-            'image_id': str(platform_variant_data.get('image_id')) if platform_variant_data.get('image_id') else None,
-            'platform_created_at': self._parse_datetime(platform_variant_data.get('created_at')),
-            'platform_updated_at': self._parse_datetime(platform_variant_data.get('updated_at')),
+            'platform_variant_id': str(get('id')),
+            'title': get('title'),
+            'sku': get('sku'),
+            'price': self._safe_decimal(get('price')),
+            'compare_at_price': self._safe_decimal(get('compare_at_price')),
+            'position': int(get('position', 1)),
+            'inventory_item_id': str(get('inventory_item_id')) if get('inventory_item_id') else None,
+            'inventory_quantity': int(get('inventory_quantity', 0)),
+            'weight': self._safe_decimal(get('weight')),
+            'weight_unit': get('weight_unit'),
+            'option1': get('option1'),
+            'option2': get('option2'),
+            'option3': get('option3'),
+            'taxable': get('taxable', True),
+            'barcode': get('barcode'),
+            'image_id': str(get('image_id')) if get('image_id') else None,
+            'platform_created_at': self._parse_datetime(get('created_at')),
+            'platform_updated_at': self._parse_datetime(get('updated_at')),
         }
     # Placeholder for line item mapping if needed later
-    async def map_line_item_to_db_model(
+    def map_line_item_to_db_model(
         self,
         platform_line_item_data: Dict,
         # order_id: uuid.UUID, # Handled by caller
         # product_id: Optional[uuid.UUID] # Handled by caller (lookup)
     ) -> Dict:
          """Transform Shopify line item data into our database model format (excluding IDs)."""
+         get = platform_line_item_data.get
          # Extract all relevant data for analytics
          return {
-            'platform_line_item_id': str(platform_line_item_data.get('id')),
-            'platform_product_id': str(platform_line_item_data.get('product_id')) if platform_line_item_data.get('product_id') else None,
-            'platform_variant_id': str(platform_line_item_data.get('variant_id')) if platform_line_item_data.get('variant_id') else None,
-            'title': platform_line_item_data.get('title'),
-            'variant_title': platform_line_item_data.get('variant_title'),
-            'sku': platform_line_item_data.get('sku'),
-            'quantity': int(platform_line_item_data.get('quantity', 0)),
-            'price': self._safe_decimal(platform_line_item_data.get('price')),
+            'platform_line_item_id': str(get('id')),
+            'platform_product_id': str(get('product_id')) if get('product_id') else None,
+            'platform_variant_id': str(get('variant_id')) if get('variant_id') else None,
+            'title': get('title'),
+            'variant_title': get('variant_title'),
+            'sku': get('sku'),
+            'quantity': int(get('quantity', 0)),
+            'price': self._safe_decimal(get('price')),
             # Additional fields for analytics
-            'total_discount': self._safe_decimal(platform_line_item_data.get('total_discount')),
-            'tax_lines': platform_line_item_data.get('tax_lines', []),
-            'properties': platform_line_item_data.get('properties', []),
-            'fulfillment_status': platform_line_item_data.get('fulfillment_status'),
-            'requires_shipping': platform_line_item_data.get('requires_shipping', False),
-            'gift_card': platform_line_item_data.get('gift_card', False),
-            'taxable': platform_line_item_data.get('taxable', True)
+            'total_discount': self._safe_decimal(get('total_discount')),
+            'tax_lines': get('tax_lines', []),
+            'properties': get('properties', []),
+            'fulfillment_status': get('fulfillment_status'),
+            'requires_shipping': get('requires_shipping', False),
+            'gift_card': get('gift_card', False),
+            'taxable': get('taxable', True)
          }
     # generate auth_url for shopify
     async def generate_auth_url(self, shop_domain: str,user_id: str = None) -> str:
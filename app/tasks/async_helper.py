@@ -1,33 +1,81 @@
 import asyncio
+import threading
+from celery.signals import worker_process_init
 from app.tasks.celery_app import celery_app
-import asyncio
+from app.db.base import engine
 from functools import wraps
+import logging
+
+logger = logging.getLogger(__name__)
+
+# One event loop per worker process, running forever in a daemon thread, so the
+# engine's asyncpg connections and their prepared statement caches outlive tasks
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+
+
+def _start_loop() -> asyncio.AbstractEventLoop:
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="async-task-loop", daemon=True).start()
+    return loop
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Return the process' persistent event loop, starting it on first use.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = _start_loop()
+        return _loop
+
+
+def run_coro(coro):
+    """
+    Runs a coroutine on the persistent event loop and waits for its result.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
 
+async def _warm_pool():
+    async with engine.connect():
+        pass
 
-def run_async(coro):  # noqa: E302
+
+@worker_process_init.connect
+def init_worker_db_pool(**kwargs):
     """
-    Runs a coroutine inside a valid or new event loop.
+    Give each forked worker process its own loop and pool, and open its first connection.
     """
+    global _loop
+    # The parent's loop thread did not survive the fork
+    with _loop_lock:
+        _loop = _start_loop()
+    # Connections inherited from the parent process must not be reused (or closed) here
+    engine.sync_engine.dispose(close=False)
+    # Warm on the persistent loop: asyncpg connections are bound to their loop
     try:
-        loop = asyncio.get_event_loop()
-        # If the loop is closed, raise to create a new one
-        if loop.is_closed():
-            raise RuntimeError
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    return loop.run_until_complete(coro)
+        run_coro(_warm_pool())
+    except Exception as exc:
+        # Not fatal: the pool connects lazily on the first task instead
+        logger.warning(f"Could not warm the database pool: {exc}")
 
 
-def celery_async_task(bind=True, max_retries=3, default_retry_delay=60*5):
+def celery_async_task(bind=True, max_retries=3, default_retry_delay=60*5, on_max_retries=None):
     """
     Decorator to define a Celery task that runs a coroutine with retry support.
 
+    The coroutine runs on the loop thread, where Celery's request context is not
+    available, so retries are handled here: a failing task is retried until
+    max_retries, then `on_max_retries(exc, *args, **kwargs)` (if given) returns
+    the task's result instead of the error being raised.
+
     Usage:
-        @celery_async_task()
-        async def initial_sync_store(self, store_id: UUID):
+        @celery_async_task(on_max_retries=_initial_sync_failed)
+        async def initial_sync_store(self, store_id: str):
             async with AsyncSessionLocal() as db:
-                return await sync_store_logic(self, store_id, db)
+                return await sync_store_logic(self, UUID(store_id), db)
     """
     def decorator(async_func):
         # Ensure we use the Celery task decorator here
@@ -41,12 +89,15 @@ def celery_async_task(bind=True, max_retries=3, default_retry_delay=60*5):
         @wraps(async_func)
         def wrapper(self, *args, **kwargs):
             try:
-                # Invoke the coroutine via run_async
-                return run_async(async_func(self, *args, **kwargs))
+                # Invoke the coroutine on the persistent loop
+                return run_coro(async_func(self, *args, **kwargs))
             except Exception as exc:
+                if on_max_retries is not None and self.max_retries is not None \
+                        and self.request.retries >= self.max_retries:
+                    return on_max_retries(exc, *args, **kwargs)
                 # Automatically retry on failure
                 raise self.retry(exc=exc)
 
         return wrapper
 
-    return decorator
\ No newline at end of file
+    return decorator
@@ -16,9 +16,13 @@ celery_app = Celery(
 
 # Celery configuration
 celery_app.conf.update(
-    task_serializer='json',
-    accept_content=['json'],
-    result_serializer='json',
+    # msgpack is a smaller and faster wire format than json; task arguments
+    # must therefore be plain types (pass store ids as str, not UUID)
+    task_serializer='msgpack',
+    # Workers still accept json so messages queued before the switch (including
+    # countdown retries) are consumed; drop it once those have drained
+    accept_content=['msgpack', 'json'],
+    result_serializer='msgpack',
     timezone='UTC',
     enable_utc=True,
 )
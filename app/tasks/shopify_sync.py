@@ -1,146 +1,307 @@
+import asyncio
 import logging
+import os
+import time
+from dataclasses import dataclass, field
+from cachetools import LFUCache
+from celery import group
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+from typing import NamedTuple
+from sqlalchemy import String, any_, bindparam, update
 from sqlalchemy.future import select
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.dialects.postgresql import ARRAY
 from app.db.models import Store, Product, Customer, Order, LineItem,ProductVariant
 from app.services.platform_connector import get_connector
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID
 from app.db.base import AsyncSessionLocal
+from app.db.bulk import bulk_upsert, replace_rows, upsert_many
+from app.core.security import decrypt_token
 from app.tasks.async_helper import celery_async_task
+from app.tasks.celery_app import celery_app
 from app.tasks.analytics_tasks import calculate_all_analytics_for_store
 logger = logging.getLogger(__name__) 
 
 # --- Placeholder CRUD Functions (Replace with actual CRUD module imports if they exist) ---
 
-async def get_customer_by_platform_id(db: AsyncSession, store_id: int, platform_customer_id: str) -> Customer | None:
+# Id lookups are built once: each call only binds parameters, so SQLAlchemy's
+# compiled cache and asyncpg's prepared statement cache are hit on every batch
+_CUSTOMER_IDS_BY_PLATFORM_IDS = select(Customer.platform_customer_id, Customer.id).where(
+    Customer.store_id == bindparam('store_id'),
+    Customer.platform_customer_id == any_(bindparam('platform_ids', type_=ARRAY(String)))
+)
+_PRODUCT_IDS_BY_PLATFORM_IDS = select(Product.platform_product_id, Product.id).where(
+    Product.store_id == bindparam('store_id'),
+    Product.platform_product_id == any_(bindparam('platform_ids', type_=ARRAY(String)))
+)
+
+async def get_customer_ids_by_platform_ids(db: AsyncSession, store_id: UUID, platform_customer_ids) -> dict:
+    """Resolve many platform customer IDs with one query. Returns platform_customer_id -> id.
+
+    The IDs are bound as a single array (= ANY($2)), so the statement text and its
+    cached asyncpg prepared statement are the same whatever the batch size.
+    """
+    if not platform_customer_ids:
+        return {}
     result = await db.execute(
-        select(Customer).where(Customer.store_id == store_id, Customer.platform_customer_id == platform_customer_id)
+        _CUSTOMER_IDS_BY_PLATFORM_IDS,
+        {'store_id': store_id, 'platform_ids': list(platform_customer_ids)}
     )
-    return result.scalars().first()
+    return dict(result.all())
 
-async def get_product_by_platform_id(db: AsyncSession, store_id: int, platform_product_id: str) -> Product | None:
+async def get_product_ids_by_platform_ids(db: AsyncSession, store_id: UUID, platform_product_ids) -> dict:
+    """Resolve many platform product IDs with one query. Returns platform_product_id -> id."""
+    if not platform_product_ids:
+        return {}
     result = await db.execute(
-        select(Product).where(Product.store_id == store_id, Product.platform_product_id == platform_product_id)
+        _PRODUCT_IDS_BY_PLATFORM_IDS,
+        {'store_id': store_id, 'platform_ids': list(platform_product_ids)}
     )
-    return result.scalars().first()
+    return dict(result.all())
 
-async def upsert_customer(db: AsyncSession, customer_data: dict):
-    # Extract tags from customer_data if present to handle separately
-    tags = customer_data.pop('tags', None)
-    
-    stmt = insert(Customer).values(**customer_data)
-    stmt = stmt.on_conflict_do_update(
-        index_elements=[Customer.store_id, Customer.platform_customer_id],
-        set_=customer_data
-    )
-    await db.execute(stmt)
-    
-    # If we have tags, update the customer after insertion
-    if tags is not None:
-        customer = await get_customer_by_platform_id(db, customer_data['store_id'], customer_data['platform_customer_id'])
-        if customer:
-            customer.tags = tags
-            db.add(customer)
-    
-    # Fetch the inserted/updated customer to get the ID
-    return await get_customer_by_platform_id(db, customer_data['store_id'], customer_data['platform_customer_id'])
+# Core table for plain UPDATEs that need no ORM session synchronization
+stores = Store.__table__
+
+class SyncStore(NamedTuple):
+    """The store columns the sync tasks read, without loading a Store entity."""
+    id: UUID
+    access_token: str
+    shop_domain: str
+    last_sync_at: datetime | None
+    platform: str
+    is_active: bool
 
-async def get_product_variant_by_platform_id(db: AsyncSession, product_id: UUID, platform_variant_id: str) -> ProductVariant | None:
+async def get_store_for_sync(db: AsyncSession, store_id: UUID) -> SyncStore | None:
     result = await db.execute(
-        select(ProductVariant).where(
-            ProductVariant.product_id == product_id, 
-            ProductVariant.platform_variant_id == platform_variant_id
-        )
+        select(
+            Store.id,
+            Store._access_token.label('encrypted_access_token'),
+            Store.shop_domain,
+            Store.last_sync_at,
+            Store.platform,
+            Store.is_active
+        ).where(Store.id == store_id)
     )
-    return result.scalars().first()
+    row = result.first()
+    if row is None:
+        return None
+    values = dict(row._mapping)
+    # Decrypt like the Store.access_token hybrid getter, which has no SQL expression
+    access_token = decrypt_token(values.pop('encrypted_access_token'))
+    return SyncStore(access_token=access_token if access_token is not None else "", **values)
+
+@dataclass
+class SyncCache:
+    """Platform ID -> database ID caches for one sync run (one store).
+
+    Seeded from the upserts' RETURNING rows and filled by the orders stream's
+    lookups, so popular customers and products are only queried once. Unknown
+    IDs are cached as None. LFU suits the power-law popularity of store data.
+    """
+    customer_ids: LFUCache = field(default_factory=lambda: LFUCache(maxsize=10000))
+    product_ids: LFUCache = field(default_factory=lambda: LFUCache(maxsize=10000))
+
+async def _resolve_ids(cache: LFUCache, platform_ids: set, lookup) -> dict:
+    """Resolve platform IDs through `cache`, querying only the misses with `lookup`.
+
+    Returns a batch-local platform_id -> id mapping (None when unknown), so cache
+    evictions can't drop IDs the batch still needs.
+    """
+    resolved = {}
+    unknown = set()
+    for platform_id in platform_ids:
+        if platform_id in cache:
+            resolved[platform_id] = cache[platform_id]
+        else:
+            unknown.add(platform_id)
+    if unknown:
+        found = await lookup(unknown)
+        for platform_id in unknown:
+            resolved[platform_id] = cache[platform_id] = found.get(platform_id)
+    return resolved
+
+class RecordFingerprints:
+    """Per-store Redis hashes of platform ID -> platform_updated_at of written records.
+
+    Shopify's updated_at_min window re-delivers records that didn't change (the
+    periodic window overlaps the previous one, and retries replay it); rows whose
+    updated_at matches the stored one are dropped before the upsert. Each record
+    has one field, overwritten as it changes, so a hash stays as large as the
+    store's record count. Fingerprints are only stored once the stream's
+    transaction committed, and Redis errors never skip a row.
+    """
+
+    TTL = timedelta(days=30)
 
-async def upsert_product_variant(db: AsyncSession, variant_data: dict):
-    stmt = insert(ProductVariant).values(**variant_data)
-    stmt = stmt.on_conflict_do_update(
-        index_elements=[ProductVariant.product_id, ProductVariant.platform_variant_id],
-        set_=variant_data
+    def __init__(self, redis: aioredis.Redis, store_id: UUID):
+        self.redis = redis
+        self.store_id = store_id
+
+    def _key(self, kind: str) -> str:
+        return f"store:{self.store_id}:{kind}_fp"
+
+    async def drop_unchanged(self, kind: str, rows: list[dict], id_key: str) -> tuple[list[dict], dict[str, str]]:
+        """Return the rows that still need writing, and their fingerprints for `remember`."""
+        fingerprints = {
+            row[id_key]: row['platform_updated_at'].isoformat()
+            for row in rows if row.get('platform_updated_at') is not None
+        }
+        if not fingerprints:
+            return rows, {}
+        try:
+            stored = await self.redis.hmget(self._key(kind), list(fingerprints))
+        except RedisError as e:
+            logger.warning("Fingerprint lookup failed for store %s, writing every %s: %s", self.store_id, kind, e)
+            return rows, {}
+        unchanged = {
+            platform_id
+            for (platform_id, updated_at), value in zip(fingerprints.items(), stored)
+            if value is not None and (value.decode() if isinstance(value, bytes) else value) == updated_at
+        }
+        changed = [row for row in rows if row[id_key] not in unchanged]
+        return changed, {platform_id: updated_at for platform_id, updated_at in fingerprints.items() if platform_id not in unchanged}
+
+    async def remember(self, kind: str, fingerprints: dict[str, str]):
+        if not fingerprints:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.hset(self._key(kind), mapping=fingerprints)
+                # Only drops the hashes of stores that stopped syncing
+                pipe.expire(self._key(kind), self.TTL)
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning("Could not store %s fingerprints for store %s: %s", kind, self.store_id, e)
+
+def _map_batch(mapper, batch: list[dict], store_id: UUID, kind: str) -> list[dict]:
+    """Map a fetched batch in one pass, before any database work. Rows that fail to map are logged and skipped."""
+    rows = []
+    for data_raw in batch:
+        try:
+            db_data = mapper(data_raw)
+        except Exception as e:
+            logger.error("Error processing %s %s for store %s: %s", kind, data_raw.get('id'), store_id, e, exc_info=True)
+            continue
+        db_data['store_id'] = store_id
+        rows.append(db_data)
+    return rows
+
+def _order_batch_platform_ids(orders_batch: list) -> tuple[set, set]:
+    """Collect the distinct platform customer and product IDs referenced by a batch of raw orders."""
+    platform_customer_ids = {
+        str(order['customer'].get('id')) for order in orders_batch if order.get('customer')
+    }
+    platform_product_ids = {
+        str(item['product_id'])
+        for order in orders_batch
+        for item in order.get('line_items', [])
+        if item.get('product_id')
+    }
+    return platform_customer_ids, platform_product_ids
+
+async def upsert_customers(db: AsyncSession, customers_data: list[dict]) -> dict:
+    """Bulk upsert a batch of mapped customers. Returns platform_customer_id -> id."""
+    if not customers_data:
+        return {}
+    conflict_cols = ['store_id', 'platform_customer_id']
+    records = await bulk_upsert(
+        db,
+        Customer.__table__,
+        customers_data,
+        conflict_cols=conflict_cols,
+        update_cols=[c for c in customers_data[0] if c not in conflict_cols],
+        returning=('id', 'platform_customer_id')
+    )
+    return {record['platform_customer_id']: record['id'] for record in records}
+
+async def upsert_product_variants(db: AsyncSession, variants_data: list[dict]):
+    """Upsert a batch of mapped product variants with one executemany of a precompiled statement."""
+    if not variants_data:
+        return
+    conflict_cols = ['product_id', 'platform_variant_id']
+    # The mapper returns a fixed set of keys, so the first row fixes the statement's shape
+    await upsert_many(
+        db,
+        ProductVariant.__table__,
+        variants_data,
+        conflict_cols=conflict_cols,
+        update_cols=[c for c in variants_data[0] if c not in conflict_cols]
     )
-    await db.execute(stmt)
-    return await get_product_variant_by_platform_id(db, variant_data['product_id'], variant_data['platform_variant_id'])
 
-async def upsert_product(db: AsyncSession, product_data: dict):
-    # Extract inventory_levels if present to handle separately
-    inventory_levels = product_data.pop('inventory_levels', None)
-    variants_data = product_data.pop('variants', [])
-    
-    stmt = insert(Product).values(**product_data)
-    stmt = stmt.on_conflict_do_update(
-        index_elements=[Product.store_id, Product.platform_product_id],
-        set_=product_data
+async def upsert_products(db: AsyncSession, connector, products_data: list[dict]) -> dict:
+    """Bulk upsert a batch of mapped products and their variants. Returns platform_product_id -> id."""
+    if not products_data:
+        return {}
+    variants_by_product = {}
+    for product_data in products_data:
+        variants_by_product[product_data['platform_product_id']] = product_data.pop('variants', [])
+
+    conflict_cols = ['store_id', 'platform_product_id']
+    records = await bulk_upsert(
+        db,
+        Product.__table__,
+        products_data,
+        conflict_cols=conflict_cols,
+        update_cols=[c for c in products_data[0] if c not in conflict_cols],
+        returning=('id', 'platform_product_id')
     )
-    await db.execute(stmt)
-    
-    # If we have inventory levels, update the product after insertion
-    if inventory_levels:
-        result = await db.execute(
-            select(Product).where(
-                Product.store_id == product_data['store_id'],
-                Product.platform_product_id == product_data['platform_product_id']
-            )
-        )
-        product = result.scalars().first()
-        if product:
-            product.inventory_levels = inventory_levels
-            db.add(product)
-    # Process variants if we have them and the product exists
-    if variants_data:
-        product = await get_product_by_platform_id(db, product_data['store_id'], product_data['platform_product_id'])
-        if  product:
-            for variant_data_raw in variants_data:
-                try:
-                    # Get the connector to map variant data
-                    connector = get_connector('shopify')
-                    variant_db_data = await connector.map_product_variant_to_db_model(variant_data_raw)
-                    variant_db_data['product_id'] = product.id
-                    await upsert_product_variant(db, variant_db_data)
-                except Exception as e:
-                    logging.error(f"Error processing variant {variant_data_raw.get('id')} for product {product.id}: {e}", exc_info=True)
-
-    return await get_product_by_platform_id(db, product_data['store_id'], product_data['platform_product_id'])
-
-async def upsert_order(db: AsyncSession, order_data: dict):
-    # Ensure line_items and discount_applications are removed before upserting the order itself
-    line_items_data = order_data.pop('line_items', [])
-    discount_applications = order_data.pop('discount_applications', None)
-    
-    stmt = insert(Order).values(**order_data)
-    stmt = stmt.on_conflict_do_update(
-        index_elements=[Order.store_id, Order.platform_order_id],
-        set_=order_data
-    ).returning(Order.id)
-    result = await db.execute(stmt)
-    order_id = result.scalar_one()
-    
-    # Update order with discount applications if present
-    if order_id and discount_applications is not None:
-        # Fetch the order to update it with discount applications
-        result = await db.execute(
-            select(Order).where(Order.id == order_id)
-        )
-        order = result.scalars().first()
-        if order:
-            order.discount_applications = discount_applications
-            db.add(order)
-    
-    # Handle line items after order is upserted
-    if order_id and line_items_data:
-        # Consider deleting existing line items for this order before inserting new ones
-        # Or implement upsert logic for line items as well
+    product_ids = {record['platform_product_id']: record['id'] for record in records}
+
+    # Process variants now that every product in the batch has an ID
+    variants_rows = []
+    for platform_product_id, variants_data in variants_by_product.items():
+        product_id = product_ids.get(platform_product_id)
+        if not product_id:
+            continue
+        for variant_data_raw in variants_data:
+            try:
+                variant_db_data = connector.map_product_variant_to_db_model(variant_data_raw)
+                variant_db_data['product_id'] = product_id
+                variants_rows.append(variant_db_data)
+            except Exception as e:
+                logger.error("Error processing variant %s for product %s: %s", variant_data_raw.get('id'), product_id, e, exc_info=True)
+    await upsert_product_variants(db, variants_rows)
+
+    return product_ids
+
+async def upsert_orders(db: AsyncSession, orders_data: list[dict], product_ids: dict, missing_products: list | None = None) -> dict:
+    """Bulk upsert a batch of mapped orders and all of their line items. Returns platform_order_id -> id."""
+    if not orders_data:
+        return {}
+    # Ensure line_items are removed before upserting the orders themselves
+    line_items_by_order = {}
+    for order_data in orders_data:
+        line_items_by_order[order_data['platform_order_id']] = order_data.pop('line_items', [])
+
+    order_conflict_cols = ['store_id', 'platform_order_id']
+    records = await bulk_upsert(
+        db,
+        Order.__table__,
+        orders_data,
+        conflict_cols=order_conflict_cols,
+        update_cols=[c for c in orders_data[0] if c not in order_conflict_cols],
+        returning=('id', 'platform_order_id')
+    )
+    order_ids = {record['platform_order_id']: record['id'] for record in records}
+
+    # Tag every line item of the batch with its order_id from the RETURNING rows
+    line_items_rows = []
+    for platform_order_id, line_items_data in line_items_by_order.items():
+        order_id = order_ids.get(platform_order_id)
+        if not order_id:
+            continue
         for item_data in line_items_data:
             item_data['order_id'] = order_id
-            # Find product_id based on platform_product_id
-            product = await get_product_by_platform_id(db, order_data['store_id'], item_data.get('platform_product_id'))
-            if product:
-                item_data['product_id'] = product.id
+            # product_ids is resolved for the whole batch before the orders are upserted
+            product_id = product_ids.get(item_data.get('platform_product_id'))
+            if product_id:
+                item_data['product_id'] = product_id
             else:
-                 # Handle case where product doesn't exist (log, skip, etc.)
-                 logger.warning(f"Product with platform ID {item_data.get('platform_product_id')} not found for store {item_data['store_id']}. Skipping line item.")
+                 # Product doesn't exist yet: skip the line item and let the caller report the misses once per batch
+                 if missing_products is not None:
+                     missing_products.append(item_data.get('platform_product_id'))
                  continue
             
             # Ensure all new fields are properly handled
@@ -154,33 +315,342 @@ async def upsert_order(db: AsyncSession, order_data: dict):
                 # Ensure properties is in the correct format for JSONB
                 if not isinstance(item_data['properties'], list):
                     item_data['properties'] = []
-            
-            # Upsert line item (assuming platform_line_item_id exists and is unique per order)
-            line_item_stmt = insert(LineItem).values(**item_data)
-            line_item_stmt = line_item_stmt.on_conflict_do_update(
-                index_elements=[LineItem.order_id, LineItem.platform_line_item_id], # Assuming this unique constraint
-                set_=item_data
+            line_items_rows.append(item_data)
+
+    # An order's line items are always replaced wholesale: delete the batch's items
+    # and COPY the new set, which also drops items removed from an order on Shopify
+    await replace_rows(
+        db,
+        LineItem.__table__,
+        'order_id',
+        list(order_ids.values()),
+        line_items_rows,
+        unique_cols=['order_id', 'platform_line_item_id']
+    )
+
+    return order_ids
+
+def _log_lookup_misses(store_id: UUID, missing_customers: list, missing_products: list):
+    """Emit one structured warning per orders batch instead of one per order / line item."""
+    if missing_customers:
+        logger.warning(
+            "customer lookup misses for store %s: %d (sample: %s)",
+            store_id, len(missing_customers), missing_customers[:5],
+            extra={'count': len(missing_customers), 'sample': missing_customers[:5], 'store_id': store_id}
+        )
+    if missing_products:
+        logger.warning(
+            "product lookup misses for store %s, skipped %d line items (sample: %s)",
+            store_id, len(missing_products), missing_products[:5],
+            extra={'count': len(missing_products), 'sample': missing_products[:5], 'store_id': store_id}
+        )
+
+class _CommitBudget:
+    """Groups several batches into one transaction.
+
+    A commit is issued once `max_rows` rows were written or `max_seconds`
+    elapsed since the last commit, whichever comes first. The upserts are
+    idempotent, so a larger transaction is safe to retry.
+    """
+
+    def __init__(self, max_rows: int = 1000, max_seconds: float = 2.0):
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.rows = 0
+        self.started = time.monotonic()
+
+    async def commit_if_due(self, db: AsyncSession, rows: int):
+        self.rows += rows
+        if self.rows >= self.max_rows or time.monotonic() - self.started >= self.max_seconds:
+            await db.commit()
+            self.rows = 0
+            self.started = time.monotonic()
+
+# --- Sync Streams ---
+# Products, customers and orders are fetched and written concurrently, each
+# writer on its own AsyncSession (a session must not be shared between tasks).
+
+async def _sync_inventory_levels(db: AsyncSession, connector, store: SyncStore):
+    """Fetch inventory levels and attach them to the store's products."""
+    logger.info(f"Fetching inventory levels for store {store.id}...")
+    try:
+        # Create a mapping of inventory_item_id to inventory level
+        inventory_map = {}
+        inventory_batches_processed = 0
+
+        try:
+            async for inventory_batch in connector.fetch_inventory_levels(access_token=store.access_token, shop_domain=store.shop_domain):
+                inventory_batches_processed += 1
+                logger.info("Processing batch of %d inventory levels...", len(inventory_batch))
+                for level in inventory_batch:
+                    inventory_item_id = level.get('inventory_item_id')
+                    if inventory_item_id:
+                        inventory_map[str(inventory_item_id)] = {
+                            'available': level.get('available'),
+                            'location_id': level.get('location_id')
+                        }
+        except Exception as inventory_fetch_error:
+            # Log the error but continue with any inventory data we might have collected
+            logger.error(f"Error fetching inventory levels for store {store.id}: {inventory_fetch_error}", exc_info=True)
+            if inventory_batches_processed == 0:
+                logger.warning(f"No inventory data was retrieved for store {store.id}. Skipping inventory update.")
+                # If we have no inventory data at all, skip the rest of the inventory processing
+                raise inventory_fetch_error
+            else:
+                logger.info(f"Proceeding with partial inventory data ({len(inventory_map)} items) for store {store.id}")
+
+        if inventory_map:
+            # Now fetch all products again to update with inventory levels
+            result = await db.execute(select(Product).where(Product.store_id == store.id))
+            products = result.scalars().all()
+
+            # We need to fetch product variants to get inventory_item_ids; each
+            # product is fetched in a worker thread so the event loop keeps serving
+            # the other sync streams
+            products_by_platform_id = {product.platform_product_id: product for product in products}
+            products_updated = 0
+            async for platform_product_id, shopify_product in connector.fetch_products_by_ids(
+                store.access_token, store.shop_domain, list(products_by_platform_id)
+            ):
+                if isinstance(shopify_product, Exception):
+                    logger.error("Error updating inventory for product %s: %s", platform_product_id, shopify_product)
+                    continue # Continue with other products
+
+                # Extract inventory_item_ids from variants
+                product_inventory = {}
+                for variant in shopify_product.get('variants', []):
+                    inventory_item_id = str(variant.get('inventory_item_id'))
+                    if inventory_item_id in inventory_map:
+                        product_inventory[str(variant.get('id'))] = inventory_map[inventory_item_id]
+
+                # Update product with inventory levels
+                if product_inventory:
+                    product = products_by_platform_id[platform_product_id]
+                    product.inventory_levels = product_inventory
+                    db.add(product)
+                    products_updated += 1
+
+            await db.commit()
+            logger.info(f"Updated inventory levels for {products_updated} products in store {store.id}")
+        else:
+            logger.warning(f"No valid inventory data found for store {store.id}. Skipping inventory update.")
+    except Exception as e:
+        logger.error(f"Error processing inventory levels for store {store.id}: {e}", exc_info=True)
+        # Continue with the rest of the sync process despite inventory issues
+
+async def _write_batches_concurrently(batches, write_batch, workers: int = 4):
+    """Feed fetched batches to `workers` writers, each on its own session.
+
+    `write_batch(db, batch)` writes one batch and returns its row count for the
+    writer's commit budget. At most two batches wait in the queue, so fetching
+    stays just ahead of the writers.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=2)
+    done = object()
+
+    async def produce():
+        async for batch in batches:
+            await queue.put(batch)
+        for _ in range(workers):
+            await queue.put(done)
+
+    async def consume():
+        async with AsyncSessionLocal() as db:
+            commit_budget = _CommitBudget()
+            while (batch := await queue.get()) is not done:
+                await commit_budget.commit_if_due(db, await write_batch(db, batch))
+            await db.commit()
+
+    tasks = [asyncio.ensure_future(produce())] + [asyncio.ensure_future(consume()) for _ in range(workers)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+async def _sync_products(store: SyncStore, connector, since: datetime | None, cache: SyncCache, done: asyncio.Event, sync_inventory: bool = False, fingerprints: RecordFingerprints | None = None):
+    """Fetch and upsert products with concurrent writers, seeding the product ID cache for the orders stream."""
+    try:
+        logger.info(f"Fetching products for store {store.id}" + (f" updated since {since}..." if since else "..."))
+        written = {}
+
+        async def write_batch(db: AsyncSession, products_batch: list[dict]) -> int:
+            logger.info("Processing batch of %d products...", len(products_batch))
+            products_rows = _map_batch(connector.map_product_to_db_model, products_batch, store.id, 'product')
+            if fingerprints:
+                products_rows, changed = await fingerprints.drop_unchanged('products', products_rows, 'platform_product_id')
+                written.update(changed)
+            cache.product_ids.update(await upsert_products(db, connector, products_rows))
+            return len(products_rows)
+
+        await _write_batches_concurrently(
+            connector.fetch_products_concurrent(access_token=store.access_token,
+                                                shop_domain=store.shop_domain,
+                                                since=since),
+            write_batch
+        )
+        if fingerprints:
+            await fingerprints.remember('products', written)
+        # Orders only need the committed products, not their inventory levels
+        done.set()
+
+        if sync_inventory:
+            async with AsyncSessionLocal() as db:
+                await _sync_inventory_levels(db, connector, store)
+    finally:
+        done.set()
+
+async def _sync_customers(store: SyncStore, connector, since: datetime | None, cache: SyncCache, done: asyncio.Event, fingerprints: RecordFingerprints | None = None):
+    """Fetch and upsert customers with concurrent writers, seeding the customer ID cache for the orders stream."""
+    try:
+        logger.info(f"Fetching customers for store {store.id}" + (f" updated since {since}..." if since else "..."))
+        written = {}
+
+        async def write_batch(db: AsyncSession, customers_batch: list[dict]) -> int:
+            logger.info("Processing batch of %d customers...", len(customers_batch))
+            customers_rows = _map_batch(connector.map_customer_to_db_model, customers_batch, store.id, 'customer')
+            if fingerprints:
+                customers_rows, changed = await fingerprints.drop_unchanged('customers', customers_rows, 'platform_customer_id')
+                written.update(changed)
+            cache.customer_ids.update(await upsert_customers(db, customers_rows))
+            return len(customers_rows)
+
+        await _write_batches_concurrently(
+            connector.fetch_customers_simple(access_token=store.access_token,
+                                             shop_domain=store.shop_domain,
+                                             since=since),
+            write_batch
+        )
+        if fingerprints:
+            await fingerprints.remember('customers', written)
+    finally:
+        done.set()
+
+async def _sync_orders(store: SyncStore, connector, since: datetime | None, cache: SyncCache, dependencies: list[asyncio.Event], fingerprints: RecordFingerprints | None = None):
+    """Fetch and upsert orders on a dedicated session.
+
+    Fetching starts right away, but no batch is written before the products and
+    customers streams (`dependencies`) have committed, so references resolve.
+    """
+    async with AsyncSessionLocal() as db:
+        logger.info(f"Fetching orders for store {store.id}" + (f" updated since {since}..." if since else "..."))
+        commit_budget = _CommitBudget()
+        written = {}
+
+        def map_order(order_data_raw: dict) -> dict:
+            order_db_data = connector.map_order_to_db_model(order_data_raw)
+            # The line-item mapper is pure CPU work, so there is nothing to overlap
+            # with asyncio.gather; map the items directly and pass them to the upsert
+            order_db_data['line_items'] = list(map(connector.map_line_item_to_db_model, order_data_raw.get('line_items', [])))
+            return order_db_data
+
+        # Note: Shopify filters on 'updated_at_min' (see the connector's _fetch_pages_concurrent), not on created_at.
+        async for orders_batch in connector.fetch_orders_concurrent(access_token=store.access_token,
+                                                                  shop_domain=store.shop_domain,
+                                                                  since=since):
+            logger.info("Processing batch of %d orders...", len(orders_batch))
+            # Stage 1: map the batch. Mapping needs no database IDs, so it runs while
+            # the products and customers streams may still be writing.
+            orders_rows = _map_batch(map_order, orders_batch, store.id, 'order')
+            if fingerprints:
+                orders_rows, changed = await fingerprints.drop_unchanged('orders', orders_rows, 'platform_order_id')
+
+            # Stage 2: resolve references and write, sequentially on this stream's session
+            for dependency in dependencies:
+                await dependency.wait()
+            missing_customers = []
+            missing_products = []
+            # Resolve every customer and product referenced by the batch up front: at most
+            # two queries per batch, only for IDs the cache hasn't seen during this run
+            platform_customer_ids, platform_product_ids = _order_batch_platform_ids(orders_batch)
+            customer_ids = await _resolve_ids(
+                cache.customer_ids, platform_customer_ids,
+                lambda ids: get_customer_ids_by_platform_ids(db, store.id, ids)
             )
-            await db.execute(line_item_stmt)
-            
-    return order_id # Or potentially the full Order object if needed
+            product_ids = await _resolve_ids(
+                cache.product_ids, platform_product_ids,
+                lambda ids: get_product_ids_by_platform_ids(db, store.id, ids)
+            )
+            unresolved = set()
+            for order_db_data in orders_rows:
+                # Find associated customer_id
+                platform_customer_id = order_db_data.pop('platform_customer_id', None) # Get platform ID from mapped data
+                customer_id = customer_ids.get(platform_customer_id) if platform_customer_id else None
+
+                if customer_id:
+                    order_db_data['customer_id'] = customer_id
+                else:
+                    order_db_data['customer_id'] = None # Or handle as needed if customer must exist
+                    if platform_customer_id:
+                        missing_customers.append(platform_customer_id)
+                        unresolved.add(order_db_data['platform_order_id'])
+                if any(item.get('platform_product_id') and not product_ids.get(item['platform_product_id'])
+                       for item in order_db_data.get('line_items', [])):
+                    unresolved.add(order_db_data['platform_order_id'])
+            if fingerprints:
+                # Orders written with a missing customer or product are not fingerprinted,
+                # so the next sync rewrites them once the reference can be resolved
+                written.update({platform_id: updated_at for platform_id, updated_at in changed.items() if platform_id not in unresolved})
+            await upsert_orders(db, orders_rows, product_ids, missing_products)
+            await commit_budget.commit_if_due(db, len(orders_batch))
+            _log_lookup_misses(store.id, missing_customers, missing_products)
+        await db.commit()
+        if fingerprints:
+            await fingerprints.remember('orders', written)
+
+def _fingerprint_redis(store_id: UUID) -> aioredis.Redis | None:
+    """Redis client for the record fingerprints, or None to write every record.
+
+    SYNC_CACHE_URL defaults to the Celery broker, which only works for a Redis broker.
+    """
+    url = os.getenv('SYNC_CACHE_URL', celery_app.conf.broker_url)
+    try:
+        return aioredis.from_url(url)
+    except (ValueError, RedisError) as e:
+        logger.warning("No fingerprint cache for store %s, writing every record: %s", store_id, e)
+        return None
+
+async def _run_sync_streams(store: SyncStore, connector, since: datetime | None, orders_since: datetime | None, sync_inventory: bool = False, skip_unchanged: bool = False):
+    """Run the products, customers and orders streams concurrently.
+
+    If one stream fails the others are cancelled and the error is re-raised, so
+    the task-level retry still covers the whole store. With `skip_unchanged`,
+    records already written at the same platform_updated_at are not upserted again.
+    """
+    cache = SyncCache() # Per run: IDs are only meaningful for this store
+    redis = _fingerprint_redis(store.id) if skip_unchanged else None
+    fingerprints = RecordFingerprints(redis, store.id) if redis else None
+    products_done = asyncio.Event()
+    customers_done = asyncio.Event()
+    tasks = [
+        asyncio.ensure_future(_sync_products(store, connector, since, cache, products_done, sync_inventory=sync_inventory, fingerprints=fingerprints)),
+        asyncio.ensure_future(_sync_customers(store, connector, since, cache, customers_done, fingerprints=fingerprints)),
+        asyncio.ensure_future(_sync_orders(store, connector, orders_since, cache, [products_done, customers_done], fingerprints=fingerprints)),
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        if redis:
+            await redis.aclose()
 
 # --- Celery Task Definition ---
 
 async def sync_store_logic(self, store_id: UUID,db: AsyncSession):
     """Celery task to perform initial data synchronization for a store."""
     logger.info(f"Starting initial sync for store_id: {store_id}")
-    # Ensure db is valid and connected
-    if db.is_active:
-        logger.info(f"Database session is active for store_id: {store_id}")
-    else:
-        logger.error(f"Database session is not active for store_id: {store_id}")
-        return f"Database session not active for store {store_id}."
-        
     try:
         # 1. Fetch Store
-        result = await db.execute(select(Store).where(Store.id == store_id))
-        store = result.scalars().first()
+        store = await get_store_for_sync(db, store_id)
+        # End the read transaction so this session holds no pooled connection while
+        # the streams run on their own sessions; the final UPDATE begins a new one
+        await db.commit()
 
         if not store:
             logger.error(f"Store with id {store_id} not found.")
@@ -189,150 +659,24 @@ async def sync_store_logic(self, store_id: UUID,db: AsyncSession):
             logger.warning(f"Store {store_id} is not active. Skipping sync.")
             return f"Store {store_id} inactive."
 
-        # 2. Get Connector and Decrypt Token
+        # 2. Get Connector (shared by the three sync streams)
         connector = get_connector(store.platform)
         if store.platform.lower() != 'shopify': # Basic check
              logger.error(f"Store {store_id} is not a Shopify store. Platform: {store.platform}")
              return f"Store {store_id} is not Shopify."
 
         # 3. Define Sync Time Range (e.g., last 6 months)
-        sync_end_date = datetime.utcnow()
+        sync_end_date = datetime.now(timezone.utc)
         sync_start_date = sync_end_date - timedelta(days=180) # Approx 6 months
 
-        # 4. Fetch and Process Data
-        # --- Products ---
-        logger.info(f"Fetching products for store {store_id}...")
-        async for products_batch in connector.fetch_products(access_token=store.access_token, shop_domain=store.shop_domain):
-            logger.info(f"Processing batch of {len(products_batch)} products...")
-            for product_data_raw in products_batch:
-                try:
-                    product_db_data = await connector.map_product_to_db_model(product_data_raw)
-                    product_db_data['store_id'] = store.id
-                    await upsert_product(db, product_db_data)
-                except Exception as e:
-                    logger.error(f"Error processing product {product_data_raw.get('id')} for store {store_id}: {e}", exc_info=True)
-            await db.commit() # Commit after each batch
-            
-        # --- Inventory Levels ---
-        logger.info(f"Fetching inventory levels for store {store_id}...")
-        try:
-            # Create a mapping of inventory_item_id to inventory level
-            inventory_map = {}
-            inventory_batches_processed = 0
-            
-            try:
-                async for inventory_batch in connector.fetch_inventory_levels(access_token=store.access_token, shop_domain=store.shop_domain):
-                    inventory_batches_processed += 1
-                    logger.info(f"Processing batch of {len(inventory_batch)} inventory levels...")
-                    for level in inventory_batch:
-                        inventory_item_id = level.get('inventory_item_id')
-                        if inventory_item_id:
-                            inventory_map[str(inventory_item_id)] = {
-                                'available': level.get('available'),
-                                'location_id': level.get('location_id')
-                            }
-            except Exception as inventory_fetch_error:
-                # Log the error but continue with any inventory data we might have collected
-                logger.error(f"Error fetching inventory levels for store {store_id}: {inventory_fetch_error}", exc_info=True)
-                if inventory_batches_processed == 0:
-                    logger.warning(f"No inventory data was retrieved for store {store_id}. Skipping inventory update.")
-                    # If we have no inventory data at all, skip the rest of the inventory processing
-                    raise inventory_fetch_error
-                else:
-                    logger.info(f"Proceeding with partial inventory data ({len(inventory_map)} items) for store {store_id}")
-            
-            if inventory_map:
-                # Now fetch all products again to update with inventory levels
-                result = await db.execute(select(Product).where(Product.store_id == store.id))
-                products = result.scalars().all()
-                
-                # We need to fetch product variants to get inventory_item_ids
-                # This is a simplified approach - in production, you'd want to batch this
-                products_updated = 0
-                for product in products:
-                    try:
-                        # Fetch product with variants from Shopify
-                        client = await connector.get_api_client(store.access_token, store.shop_domain)
-                        shopify_product = client.Product.find(product.platform_product_id)
-                        
-                        # Extract inventory_item_ids from variants
-                        product_inventory = {}
-                        for variant in shopify_product.variants:
-                            inventory_item_id = str(variant.inventory_item_id)
-                            if inventory_item_id in inventory_map:
-                                variant_id = str(variant.id)
-                                product_inventory[variant_id] = inventory_map[inventory_item_id]
-                        
-                        # Update product with inventory levels
-                        if product_inventory:
-                            product.inventory_levels = product_inventory
-                            db.add(product)
-                            products_updated += 1
-                    except Exception as e:
-                        logger.error(f"Error updating inventory for product {product.platform_product_id}: {e}", exc_info=True)
-                        # Continue with other products
-                
-                await db.commit()
-                logger.info(f"Updated inventory levels for {products_updated} products in store {store_id}")
-            else:
-                logger.warning(f"No valid inventory data found for store {store_id}. Skipping inventory update.")
-        except Exception as e:
-            logger.error(f"Error processing inventory levels for store {store_id}: {e}", exc_info=True)
-            # Continue with the rest of the sync process despite inventory issues
-
-        # --- Customers ---
-        logger.info(f"Fetching customers for store {store_id}...")
-        async for customers_batch in connector.fetch_customers(access_token=store.access_token, shop_domain=store.shop_domain):
-            logger.info(f"Processing batch of {len(customers_batch)} customers...")
-            for customer_data_raw in customers_batch:
-                try:                    
-                    customer_db_data = await connector.map_customer_to_db_model(customer_data_raw)
-                    customer_db_data['store_id'] = store.id
-                    await upsert_customer(db, customer_db_data)
-                except Exception as e:
-                    logger.error(f"Error processing customer {customer_data_raw.get('id')} for store {store_id}: {e}", exc_info=True)
-            await db.commit() # Commit after each batch
-
-        # --- Orders ---
-        logger.info(f"Fetching orders for store {store_id} from {sync_start_date} to {sync_end_date}...")
-        async for orders_batch in connector.fetch_orders(access_token=store.access_token, shop_domain=store.shop_domain, since=sync_start_date): # Pass token, domain, and since
-            # Note: Shopify API usually uses 'since_id' or 'updated_at_min' for filtering, not created_at range directly for all resources.
-            # Adjusting to use 'since' based on connector's _fetch_all_resources which uses 'updated_at_min'.
-            # If created_at filtering is strictly needed, the connector method might need adjustment.
-            logger.info(f"Processing batch of {len(orders_batch)} orders...")
-            for order_data_raw in orders_batch:
-                try:
-                    order_db_data = await connector.map_order_to_db_model(order_data_raw)
-                    order_db_data['store_id'] = store.id
-
-                    # Find associated customer_id
-                    platform_customer_id = order_db_data.pop('platform_customer_id', None) # Get platform ID from mapped data
-                    customer = None
-                    if platform_customer_id:
-                        customer = await get_customer_by_platform_id(db, store.id, platform_customer_id)
-                    
-                    if customer:
-                        order_db_data['customer_id'] = customer.id
-                    else:
-                        order_db_data['customer_id'] = None # Or handle as needed if customer must exist
-                        logger.warning(f"Customer with platform ID {platform_customer_id} not found for store {store_id} while processing order {order_data_raw.get('id')}.")
-
-                    # Extract line items (assuming map_order_to_db_model includes them or they need separate mapping)
-                    # The placeholder upsert_order handles line items internally now
-                    line_items_raw = order_data_raw.get('line_items', [])
-                    mapped_line_items = [
-                        await connector.map_line_item_to_db_model(item) for item in line_items_raw
-                    ]
-                    order_db_data['line_items'] = mapped_line_items # Pass mapped items to upsert
-
-                    await upsert_order(db, order_db_data)
-                except Exception as e:
-                    logger.error(f"Error processing order {order_data_raw.get('id')} for store {store_id}: {e}", exc_info=True)
-            await db.commit() # Commit after each batch
+        # 4. Fetch and Process Data (all products and customers, orders from the last 6 months)
+        logger.info(f"Syncing orders for store {store_id} from {sync_start_date} to {sync_end_date}")
+        await _run_sync_streams(store, connector, since=None, orders_since=sync_start_date, sync_inventory=True)
 
         # 5. Update Last Sync Time
-        store.last_sync_at = datetime.utcnow()
-        db.add(store)
+        # Record when this sync started (the end of its fetch window), so records changed
+        # while the streams ran fall into the next periodic window
+        await db.execute(update(stores).where(stores.c.id == store_id).values(last_sync_at=sync_end_date))
         await db.commit()
         logger.info(f"Successfully completed initial sync for store_id: {store_id}")
 
@@ -342,27 +686,19 @@ async def sync_store_logic(self, store_id: UUID,db: AsyncSession):
     except Exception as exc:
         logger.error(f"Initial sync failed for store {store_id}: {exc}", exc_info=True)
         await db.rollback() # Rollback on failure
-        try:
-            # Retry the task with exponential backoff
-            raise self.retry(exc=exc)
-        except self.MaxRetriesExceededError:
-            logger.critical(f"Initial sync for store {store_id} failed after max retries.")
-            # Optionally, mark the store sync status as failed in the DB
-            return f"Sync failed permanently for store {store_id}."
-    finally:
-        # Ensure the database session is properly closed if it's still active
-        if db and db.is_active:
-            try:
-                await db.close()
-                logger.info(f"Database session closed for store_id: {store_id}")
-            except Exception as e:
-                logger.error(f"Error closing database session for store_id {store_id}: {e}", exc_info=True)
+        # The task wrapper retries the task, see celery_async_task
+        raise
 
-@celery_async_task()
-async def initial_sync_store(self, store_id: UUID):
+def _initial_sync_failed_permanently(exc: Exception, store_id: str) -> str:
+    logger.critical(f"Initial sync for store {store_id} failed after max retries.")
+    # Optionally, mark the store sync status as failed in the DB
+    return f"Sync failed permanently for store {store_id}."
+
+@celery_async_task(on_max_retries=_initial_sync_failed_permanently)
+async def initial_sync_store(self, store_id: str):
     """Task for initial store synchronization"""
     async with AsyncSessionLocal() as db:
-        return await sync_store_logic(self, store_id, db)
+        return await sync_store_logic(self, UUID(store_id), db)
 
 async def _periodic_sync_logic(self, store_id: UUID, db: AsyncSession):
     """Logic for periodically syncing data for a specific store.
@@ -371,17 +707,12 @@ async def _periodic_sync_logic(self, store_id: UUID, db: AsyncSession):
     It uses the store's last_sync_at timestamp as the starting point.
     """
     logger.info(f"Starting periodic sync for store_id: {store_id}")
-    # Ensure db is valid and connected
-    if db.is_active:
-        logger.info(f"Database session is active for store_id: {store_id}")
-    else:
-        logger.error(f"Database session is not active for store_id: {store_id}")
-        return f"Database session not active for store {store_id}."
-        
     try:
         # 1. Fetch Store
-        result = await db.execute(select(Store).where(Store.id == store_id))
-        store = result.scalars().first()
+        store = await get_store_for_sync(db, store_id)
+        # End the read transaction so this session holds no pooled connection while
+        # the streams run on their own sessions; the final UPDATE begins a new one
+        await db.commit()
 
         if not store:
             logger.error(f"Store with id {store_id} not found.")
@@ -390,14 +721,14 @@ async def _periodic_sync_logic(self, store_id: UUID, db: AsyncSession):
             logger.warning(f"Store {store_id} is not active. Skipping sync.")
             return f"Store {store_id} inactive."
 
-        # 2. Get Connector and Decrypt Token
+        # 2. Get Connector (shared by the three sync streams)
         connector = get_connector(store.platform)
         if store.platform.lower() != 'shopify': # Basic check
              logger.error(f"Store {store_id} is not a Shopify store. Platform: {store.platform}")
              return f"Store {store_id} is not Shopify."
 
         # 3. Define Sync Time Range (from last sync to now)
-        sync_end_date = datetime.utcnow()
+        sync_end_date = datetime.now(timezone.utc)
         
         # Use last_sync_at as the starting point, with a small buffer to avoid missing data
         # If last_sync_at is None (never synced), use a default (e.g., 7 days ago)
@@ -412,74 +743,14 @@ async def _periodic_sync_logic(self, store_id: UUID, db: AsyncSession):
         logger.info(f"Syncing data for store {store_id} from {sync_start_date} to {sync_end_date}")
 
         # 4. Fetch and Process Data
-        # --- Products ---
-        logger.info(f"Fetching products updated since {sync_start_date} for store {store_id}...")
-        async for products_batch in connector.fetch_products(access_token=store.access_token, 
-                                                           shop_domain=store.shop_domain, 
-                                                           since=sync_start_date):
-            logger.info(f"Processing batch of {len(products_batch)} products...")
-            for product_data_raw in products_batch:
-                try:
-                    product_db_data = await connector.map_product_to_db_model(product_data_raw)
-                    product_db_data['store_id'] = store.id
-                    await upsert_product(db, product_db_data)
-                except Exception as e:
-                    logger.error(f"Error processing product {product_data_raw.get('id')} for store {store_id}: {e}", exc_info=True)
-            await db.commit() # Commit after each batch
-
-        # --- Customers ---
-        logger.info(f"Fetching customers updated since {sync_start_date} for store {store_id}...")
-        async for customers_batch in connector.fetch_customers(access_token=store.access_token, 
-                                                             shop_domain=store.shop_domain, 
-                                                             since=sync_start_date):
-            logger.info(f"Processing batch of {len(customers_batch)} customers...")
-            for customer_data_raw in customers_batch:
-                try:
-                    customer_db_data = await connector.map_customer_to_db_model(customer_data_raw)
-                    customer_db_data['store_id'] = store.id
-                    await upsert_customer(db, customer_db_data)
-                except Exception as e:
-                    logger.error(f"Error processing customer {customer_data_raw.get('id')} for store {store_id}: {e}", exc_info=True)
-            await db.commit() # Commit after each batch
-
-        # --- Orders ---
-        logger.info(f"Fetching orders updated since {sync_start_date} for store {store_id}...")
-        async for orders_batch in connector.fetch_orders(access_token=store.access_token, 
-                                                       shop_domain=store.shop_domain, 
-                                                       since=sync_start_date):
-            logger.info(f"Processing batch of {len(orders_batch)} orders...")
-            for order_data_raw in orders_batch:
-                try:
-                    order_db_data = await connector.map_order_to_db_model(order_data_raw)
-                    order_db_data['store_id'] = store.id
-
-                    # Find associated customer_id
-                    platform_customer_id = order_db_data.pop('platform_customer_id', None) # Get platform ID from mapped data
-                    customer = None
-                    if platform_customer_id:
-                        customer = await get_customer_by_platform_id(db, store.id, platform_customer_id)
-                    
-                    if customer:
-                        order_db_data['customer_id'] = customer.id
-                    else:
-                        order_db_data['customer_id'] = None # Or handle as needed if customer must exist
-                        logger.warning(f"Customer with platform ID {platform_customer_id} not found for store {store_id} while processing order {order_data_raw.get('id')}.")
-
-                    # Extract line items (assuming map_order_to_db_model includes them or they need separate mapping)
-                    line_items_raw = order_data_raw.get('line_items', [])
-                    mapped_line_items = [
-                        await connector.map_line_item_to_db_model(item) for item in line_items_raw
-                    ]
-                    order_db_data['line_items'] = mapped_line_items # Pass mapped items to upsert
-
-                    await upsert_order(db, order_db_data)
-                except Exception as e:
-                    logger.error(f"Error processing order {order_data_raw.get('id')} for store {store_id}: {e}", exc_info=True)
-            await db.commit() # Commit after each batch
+        # Fingerprints are only trusted once the store had a complete sync
+        await _run_sync_streams(store, connector, since=sync_start_date, orders_since=sync_start_date,
+                                skip_unchanged=store.last_sync_at is not None)
 
         # 5. Update Last Sync Time
-        store.last_sync_at = datetime.utcnow()
-        db.add(store)
+        # Record when this sync started (the end of its fetch window), so records changed
+        # while the streams ran fall into the next periodic window
+        await db.execute(update(stores).where(stores.c.id == store_id).values(last_sync_at=sync_end_date))
         await db.commit()
         logger.info(f"Successfully completed periodic sync for store_id: {store_id}")
         return f"Periodic sync completed for store {store_id}."
@@ -487,28 +758,20 @@ async def _periodic_sync_logic(self, store_id: UUID, db: AsyncSession):
     except Exception as exc:
         logger.error(f"Periodic sync failed for store {store_id}: {exc}", exc_info=True)
         await db.rollback() # Rollback on failure
-        try:
-            # Retry the task with exponential backoff
-            raise self.retry(exc=exc)
-        except self.MaxRetriesExceededError:
-            logger.critical(f"Periodic sync for store {store_id} failed after max retries.")
-            # Optionally, mark the store sync status as failed in the DB
-            return f"Periodic sync failed permanently for store {store_id}."
-    finally:
-        # Ensure the database session is properly closed if it's still active
-        if db and db.is_active:
-            try:
-                await db.close()
-                logger.info(f"Database session closed for store_id: {store_id}")
-            except Exception as e:
-                logger.error(f"Error closing database session for store_id {store_id}: {e}", exc_info=True)
+        # The task wrapper retries the task, see celery_async_task
+        raise
 
 # --- Periodic Sync Task ---
-@celery_async_task()
-async def periodic_sync_store(self, store_id: UUID):
+def _periodic_sync_failed_permanently(exc: Exception, store_id: str) -> str:
+    logger.critical(f"Periodic sync for store {store_id} failed after max retries.")
+    # Optionally, mark the store sync status as failed in the DB
+    return f"Periodic sync failed permanently for store {store_id}."
+
+@celery_async_task(on_max_retries=_periodic_sync_failed_permanently)
+async def periodic_sync_store(self, store_id: str):
     """Task for periodically syncing data for a specific store."""
     async with AsyncSessionLocal() as db:
-        return await _periodic_sync_logic(self, store_id, db)
+        return await _periodic_sync_logic(self, UUID(store_id), db)
 
 # --- Scheduler Task --- 
 async def _schedule_periodic_syncs_logic():
@@ -518,25 +781,18 @@ async def _schedule_periodic_syncs_logic():
     logger.info("Starting to schedule periodic syncs for all active stores")
     try:
         async with AsyncSessionLocal() as db:
-            # Query all active stores
-            result = await db.execute(select(Store).where(Store.is_active == True))
-            stores = result.scalars().all()
-            if not stores:
+            # Query the ids of all active stores
+            result = await db.execute(select(Store.id).where(Store.is_active == True))
+            store_ids = result.scalars().all()
+            if not store_ids:
                 logger.info("No active stores found for periodic sync scheduling.")
                 return "No active stores found."
-            # Schedule a periodic sync task for each active store
-            scheduled_count = 0
-            for store in stores:
-                try:
-                    # Schedule the periodic sync task
-                    # The task will be executed asynchronously by Celery
-                    periodic_sync_store.delay(store.id)
-                    scheduled_count += 1
-                    logger.info(f"Scheduled periodic sync for store {store.id}")
-                except Exception as e:
-                    logger.error(f"Failed to schedule periodic sync for store {store.id}: {e}", exc_info=True)
-            logger.info(f"Scheduled periodic syncs for {scheduled_count} stores.")
-            return f"Scheduled periodic syncs for {scheduled_count} stores."
+        # Schedule a periodic sync task for each active store; the group publishes
+        # every message through a single acquired producer/broker connection
+        group(periodic_sync_store.s(str(store_id)) for store_id in store_ids).apply_async()
+        scheduled_count = len(store_ids)
+        logger.info(f"Scheduled periodic syncs for {scheduled_count} stores.")
+        return f"Scheduled periodic syncs for {scheduled_count} stores."
     except Exception as exc:
         logger.error(f"Failed to schedule periodic syncs: {exc}", exc_info=True)
         return f"Failed to schedule periodic syncs: {exc}"
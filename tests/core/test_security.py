@@ -1,25 +1,64 @@
+import base64
 import os
+import platform
 import pytest
-from cryptography.fernet import Fernet
+from hypothesis import example, given, strategies as st
 from app.core.security import (
     hash_password,
     verify_password,
     encrypt_token,
+    encrypt_token_raw,
+    encrypt_tokens,
     decrypt_token,
-    get_encryption_key
+    decrypt_token_raw,
+    decrypt_tokens,
+    get_encryption_key,
+    get_fernet_keys,
+    get_token_cipher,
+    get_pwd_context
 )
 
 # Test data
 TEST_PASSWORD = "mysecretpassword123"
 TEST_TOKEN = "shpat_12345abcde67890fghijk"
-TEST_ENCRYPTION_KEY = Fernet.generate_key()
 
-@pytest.fixture(autouse=True)
-def setup_encryption_key(monkeypatch):
-    """Setup test encryption key for all tests"""
-    monkeypatch.setenv("ENCRYPTION_KEY", TEST_ENCRYPTION_KEY.decode())
+@pytest.fixture(scope="session")
+def encryption_key():
+    """Test encryption key, generated only when a test needs it"""
+    from cryptography.fernet import Fernet
+    return Fernet.generate_key()
 
-def test_password_hashing():
+@pytest.fixture(scope="session")
+def setup_encryption_key(encryption_key):
+    """Setup test encryption key once for the whole session, for the tests that request it"""
+    # monkeypatch is function-scoped, so the variable is saved and restored by hand.
+    # Under pytest-xdist (pytest -n auto) every worker runs its own session, so
+    # each sets the variable once in its own process and tests never write it
+    previous = os.environ.get("ENCRYPTION_KEY")
+    os.environ["ENCRYPTION_KEY"] = encryption_key.decode()
+    # The key and the ciphers derived from it are cached per process
+    get_encryption_key.cache_clear()
+    get_token_cipher.cache_clear()
+    get_fernet_keys.cache_clear()
+    yield
+    if previous is None:
+        os.environ.pop("ENCRYPTION_KEY", None)
+    else:
+        os.environ["ENCRYPTION_KEY"] = previous
+    get_encryption_key.cache_clear()
+    get_token_cipher.cache_clear()
+    get_fernet_keys.cache_clear()
+
+@pytest.fixture
+def cheap_password_hashing(monkeypatch):
+    """Hash passwords at minimum argon2 cost; correctness doesn't need production cost"""
+    monkeypatch.setenv("PASSWORD_HASH_COST", "1")
+    monkeypatch.setenv("PASSWORD_HASH_MEMORY_COST", "8")
+    get_pwd_context.cache_clear()
+    yield
+    get_pwd_context.cache_clear()
+
+def test_password_hashing(cheap_password_hashing):
     """Test that password hashing and verification work correctly"""
     # Hash the password
     hashed = hash_password(TEST_PASSWORD)
@@ -33,51 +72,144 @@ def test_password_hashing():
     # Verify incorrect password fails
     assert verify_password("wrongpassword", hashed) is False
 
-def test_token_encryption():
-    """Test that token encryption and decryption work correctly"""
-    # Encrypt the token
-    encrypted = encrypt_token(TEST_TOKEN)
-    
-    # Verify the encrypted token is different from the original
-    assert encrypted != TEST_TOKEN
-    
-    # Decrypt and verify it matches the original
-    decrypted = decrypt_token(encrypted)
-    assert decrypted == TEST_TOKEN
-
-def test_token_encryption_empty_values():
-    """Test handling of empty/None values in token encryption"""
-    # Test empty string
-    assert encrypt_token("") == ""
-    assert decrypt_token("") is None
-    
-    # Test None value for encryption
-    assert encrypt_token(None) == ""
+@pytest.mark.usefixtures("setup_encryption_key")
+class TestTokenEncryption:
+    """Tests that need ENCRYPTION_KEY; the key fixture is requested here only"""
 
-def test_token_decryption_invalid_token():
-    """Test decryption with invalid token"""
-    # Test with invalid encrypted data
-    assert decrypt_token("invalid_token") is None
-    
-    # Test with valid base64 but invalid token
-    invalid_token = "d2VsbCB0aGlzIGlzIG5vdCBhIHZhbGlkIHRva2Vu"  # base64 encoded
-    assert decrypt_token(invalid_token) is None
-
-def test_encryption_key_environment():
-    """Test encryption key retrieval"""
-    key = get_encryption_key()
-    assert isinstance(key, bytes)
-    assert len(key) > 0
-
-def test_token_encryption_consistency():
-    """Test that encryption/decryption is consistent across multiple operations"""
-    # Encrypt the same token multiple times
-    encrypted1 = encrypt_token(TEST_TOKEN)
-    encrypted2 = encrypt_token(TEST_TOKEN)
-    
-    # Each encryption should produce different results (due to random IV)
-    assert encrypted1 != encrypted2
-    
-    # But both should decrypt to the same original token
-    assert decrypt_token(encrypted1) == TEST_TOKEN
-    assert decrypt_token(encrypted2) == TEST_TOKEN 
\ No newline at end of file
+    @given(st.text())
+    @example(TEST_TOKEN)
+    def test_token_roundtrip(self, token):
+        """Test that decrypting an encrypted token returns the original (None for empty)"""
+        encrypted = encrypt_token(token)
+
+        # Verify the encrypted token is different from the original
+        if token:
+            assert encrypted != token
+
+        assert decrypt_token(encrypted) == (token if token else None)
+
+    def test_token_encryption_empty_values(self):
+        """Test handling of empty/None values in token encryption"""
+        assert encrypt_token("") == ""
+        assert encrypt_token(None) == ""
+        assert decrypt_token("") is None
+
+    @pytest.mark.parametrize("encrypted_token", [
+        "invalid_token",
+        "d2VsbCB0aGlzIGlzIG5vdCBhIHZhbGlkIHRva2Vu",  # valid base64 but invalid token
+        base64.urlsafe_b64encode(b"\x81" + bytes(40)).decode(),  # AES-GCM framing, bad tag
+        base64.urlsafe_b64encode(b"\x80" + bytes(88)).decode(),  # legacy Fernet framing, bad HMAC
+        "tökén",  # not ASCII, so not base64
+    ])
+    def test_token_decryption_invalid_token(self, encrypted_token):
+        """Test decryption with invalid token"""
+        assert decrypt_token(encrypted_token) is None
+
+    def test_token_encryption_raw(self):
+        """Test that raw (un-base64'd) tokens round-trip"""
+        raw = encrypt_token_raw(TEST_TOKEN)
+
+        # AES-GCM framing: version byte, 12-byte nonce, ciphertext, 16-byte tag
+        assert isinstance(raw, bytes)
+        assert raw[0] == 0x81
+        assert len(raw) == 1 + 12 + len(TEST_TOKEN) + 16
+        assert decrypt_token(raw) == TEST_TOKEN
+
+        # encrypt_token returns its base64 encoding
+        assert decrypt_token(base64.urlsafe_b64encode(raw).decode()) == TEST_TOKEN
+        assert encrypt_token_raw("") == b""
+
+        # Tampered raw tokens are rejected
+        assert decrypt_token(raw[:-1] + bytes([raw[-1] ^ 1])) is None
+
+    def test_legacy_fernet_token(self, encryption_key):
+        """Test that tokens encrypted with Fernet before the AES-GCM switch still decrypt"""
+        from cryptography.fernet import Fernet
+        legacy = Fernet(encryption_key).encrypt(TEST_TOKEN.encode())
+
+        assert decrypt_token(legacy.decode()) == TEST_TOKEN
+        assert decrypt_token(base64.urlsafe_b64decode(legacy)) == TEST_TOKEN
+        assert decrypt_tokens([legacy.decode()]) == [TEST_TOKEN]
+
+        # Re-encrypting moves it to the current format
+        rotated, = encrypt_tokens(decrypt_tokens([legacy.decode()]))
+        assert base64.urlsafe_b64decode(rotated)[0] == 0x81
+        assert decrypt_token(rotated) == TEST_TOKEN
+
+    def test_token_encryption_bytes(self):
+        """Test the bytes-in/bytes-out raw token API"""
+        token = TEST_TOKEN.encode()
+        raw = encrypt_token_raw(token)
+
+        assert decrypt_token_raw(raw) == token
+        assert decrypt_token(raw) == TEST_TOKEN
+        assert decrypt_token_raw(b"") is None
+        assert decrypt_token_raw(b"invalid_token") is None
+
+    def test_encryption_key_environment(self):
+        """Test encryption key retrieval"""
+        key = get_encryption_key()
+        assert isinstance(key, bytes)
+        assert len(key) > 0
+
+    @given(st.text(min_size=1))
+    @example(TEST_TOKEN)
+    def test_token_encryption_consistency(self, token):
+        """Test that encryption/decryption is consistent across multiple operations"""
+        # Encrypt the same token multiple times
+        encrypted1 = encrypt_token(token)
+        encrypted2 = encrypt_token(token)
+
+        # Each encryption should produce different results (due to random IV)
+        assert encrypted1 != encrypted2
+
+        # But both should decrypt to the same original token
+        assert decrypt_token(encrypted1) == token
+        assert decrypt_token(encrypted2) == token
+
+    def test_token_batch_encryption(self):
+        """Test that batch encryption/decryption matches the single-token functions"""
+        encrypted1, encrypted2 = encrypt_tokens([TEST_TOKEN, TEST_TOKEN])
+
+        # Each encryption still uses a fresh IV
+        assert encrypted1 != encrypted2
+        assert decrypt_tokens([encrypted1, encrypted2]) == [TEST_TOKEN, TEST_TOKEN]
+
+        # Larger batches keep order; empty values and invalid tokens behave as in the single calls
+        tokens = [f"{TEST_TOKEN}_{i}" for i in range(100)] + ["", None]
+        encrypted = encrypt_tokens(tokens)
+        assert encrypted[-2:] == ["", ""]
+        assert decrypt_tokens(encrypted) == tokens[:100] + [None, None]
+        assert decrypt_tokens(["invalid_token", encrypt_token_raw(TEST_TOKEN)]) == [None, TEST_TOKEN]
+
+def _openssl_masks_capability(field: int, bit: int) -> bool:
+    """Whether OPENSSL_ia32cap in the environment switches off a CPU capability bit"""
+    fields = os.environ.get("OPENSSL_ia32cap", "").split(":")
+    if len(fields) <= field or not fields[field]:
+        return False
+    value = fields[field]
+    if value.startswith("~"):
+        return bool(int(value[1:], 0) & bit)
+    return not int(value, 0) & bit
+
+@pytest.mark.skipif(
+    platform.machine() not in ("x86_64", "AMD64") or not os.path.exists("/proc/cpuinfo"),
+    reason="AES-NI/SHA-NI check needs an x86-64 Linux host"
+)
+def test_openssl_ia32cap_does_not_mask_aes_ni():
+    """Test that OPENSSL_ia32cap doesn't hide the CPU's AES-NI/SHA-NI instructions from OpenSSL"""
+    # Store tokens are AES-256-GCM (see encrypt_token) and every sync decrypts them.
+    # Without AES-NI and PCLMULQDQ, OpenSSL falls back to software AES and GHASH,
+    # which are several times slower, and this happens silently.
+    with open("/proc/cpuinfo") as cpuinfo:
+        flags = next((line.split(":", 1)[1].split() for line in cpuinfo if line.startswith("flags")), [])
+    if "aes" not in flags:
+        pytest.skip("CPU does not support AES-NI")
+
+    # AES-NI is CPUID.1:ECX bit 25, i.e. bit 57 of the first OPENSSL_ia32cap word
+    assert not _openssl_masks_capability(0, 1 << 57), "OPENSSL_ia32cap disables AES-NI"
+    # PCLMULQDQ (GCM's GHASH) is CPUID.1:ECX bit 1
+    assert not _openssl_masks_capability(0, 1 << 33), "OPENSSL_ia32cap disables PCLMULQDQ"
+    if "sha_ni" in flags:
+        # SHA extensions are CPUID.7:EBX bit 29 of the second word
+        assert not _openssl_masks_capability(1, 1 << 29), "OPENSSL_ia32cap disables SHA-NI"
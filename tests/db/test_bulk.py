@@ -0,0 +1,158 @@
+import asyncio
+import uuid
+from app.db import bulk
+from app.db.bulk import bulk_upsert, replace_rows, upsert_many
+from app.db.models import Customer, LineItem, Order, ProductVariant
+
+class FakeConnection:
+    """Records the asyncpg calls made on it; fetch returns `records`"""
+    def __init__(self, records=()):
+        self.records = list(records)
+        self.calls = []
+
+    async def execute(self, sql, *args):
+        self.calls.append(('execute', sql, args))
+
+    async def executemany(self, sql, args):
+        self.calls.append(('executemany', sql, args))
+
+    async def fetch(self, sql, *args):
+        self.calls.append(('fetch', sql, args))
+        return self.records
+
+    async def copy_records_to_table(self, table_name, records, columns):
+        self.calls.append(('copy', table_name, records, columns))
+
+def use_connection(monkeypatch, connection):
+    async def get_driver_connection(session):
+        return connection
+
+    monkeypatch.setattr(bulk, 'get_driver_connection', get_driver_connection)
+
+STORE_ID = uuid.uuid4()
+
+def test_bulk_upsert_stages_and_merges(monkeypatch):
+    """Test that rows are copied into a per-transaction stage and merged with one INSERT ... ON CONFLICT"""
+    connection = FakeConnection(records=[{'id': 1, 'platform_customer_id': '1'}])
+    use_connection(monkeypatch, connection)
+    rows = [
+        {'store_id': STORE_ID, 'platform_customer_id': '1', 'email': 'old@example.com'},
+        {'store_id': STORE_ID, 'platform_customer_id': '1', 'email': 'new@example.com'},
+    ]
+
+    result = asyncio.run(bulk_upsert(
+        None, Customer.__table__, rows,
+        conflict_cols=['store_id', 'platform_customer_id'],
+        update_cols=['email'],
+        returning=('id', 'platform_customer_id')
+    ))
+
+    assert result == connection.records
+    assert connection.calls == [
+        ('execute',
+         "CREATE TEMP TABLE IF NOT EXISTS stage_customers (LIKE customers INCLUDING DEFAULTS) ON COMMIT DROP; "
+         "TRUNCATE stage_customers",
+         ()),
+        # Rows sharing a conflict key are collapsed, last one wins
+        ('copy', 'stage_customers', [(STORE_ID, '1', 'new@example.com')], ['store_id', 'platform_customer_id', 'email']),
+        ('fetch',
+         "INSERT INTO customers (store_id, platform_customer_id, email) "
+         "SELECT store_id, platform_customer_id, email FROM stage_customers "
+         "ON CONFLICT (store_id, platform_customer_id) DO UPDATE SET email = EXCLUDED.email "
+         "RETURNING id, platform_customer_id",
+         ()),
+    ]
+
+def test_bulk_upsert_encodes_json_columns(monkeypatch):
+    """Test that JSON/JSONB values are serialized for COPY and other values are passed through"""
+    connection = FakeConnection()
+    use_connection(monkeypatch, connection)
+    rows = [{'store_id': STORE_ID, 'platform_order_id': '1', 'discount_applications': [{'code': 'SAVE10'}]}]
+
+    asyncio.run(bulk_upsert(
+        None, Order.__table__, rows,
+        conflict_cols=['store_id', 'platform_order_id'],
+        update_cols=[],
+        returning=()
+    ))
+
+    copy, merge = connection.calls[1:]
+    assert copy[2] == [(STORE_ID, '1', '[{"code":"SAVE10"}]')]
+    # No update columns: conflicting rows are left alone, and nothing is returned
+    assert merge[0] == 'execute'
+    assert merge[1].endswith("ON CONFLICT (store_id, platform_order_id) DO NOTHING")
+
+def test_bulk_upsert_without_rows_skips_the_database(monkeypatch):
+    connection = FakeConnection()
+    use_connection(monkeypatch, connection)
+
+    assert asyncio.run(bulk_upsert(None, Customer.__table__, [], ['store_id'], [])) == []
+    assert connection.calls == []
+
+def test_upsert_many_binds_rows_positionally(monkeypatch):
+    """Test that one shape of rows is written with a single executemany of positional parameters"""
+    connection = FakeConnection()
+    use_connection(monkeypatch, connection)
+    product_id = uuid.uuid4()
+    rows = [
+        {'product_id': product_id, 'platform_variant_id': '1', 'sku': 'A'},
+        {'product_id': product_id, 'platform_variant_id': '2', 'sku': 'B'},
+    ]
+
+    asyncio.run(upsert_many(None, ProductVariant.__table__, rows, ['platform_variant_id'], ['sku']))
+
+    assert connection.calls == [(
+        'executemany',
+        "INSERT INTO product_variants (product_id, platform_variant_id, sku) VALUES ($1, $2, $3) "
+        "ON CONFLICT (platform_variant_id) DO UPDATE SET sku = EXCLUDED.sku",
+        [(product_id, '1', 'A'), (product_id, '2', 'B')],
+    )]
+
+def test_upsert_sql_is_cached_per_shape(monkeypatch):
+    """Test that the SQL is built once per table, column order and conflict/update columns"""
+    monkeypatch.setattr(bulk, '_UPSERT_SQL', {})
+    table = ProductVariant.__table__
+
+    sql = bulk._upsert_sql(table, ['platform_variant_id', 'sku'], ['platform_variant_id'], ['sku'])
+
+    assert bulk._upsert_sql(table, ('platform_variant_id', 'sku'), ('platform_variant_id',), ('sku',)) is sql
+    assert list(bulk._UPSERT_SQL) == [('product_variants', ('platform_variant_id', 'sku'), ('platform_variant_id',), ('sku',))]
+    # A different column order is a different statement
+    other = bulk._upsert_sql(table, ['sku', 'platform_variant_id'], ['platform_variant_id'], ['sku'])
+    assert other.startswith("INSERT INTO product_variants (sku, platform_variant_id) VALUES ($1, $2)")
+    assert len(bulk._UPSERT_SQL) == 2
+
+def test_replace_rows_deletes_then_copies(monkeypatch):
+    """Test that the keys' rows are deleted and the new rows copied straight into the table"""
+    connection = FakeConnection()
+    use_connection(monkeypatch, connection)
+    order_id = uuid.uuid4()
+    rows = [
+        {'order_id': order_id, 'platform_line_item_id': '1', 'quantity': 1, 'requires_shipping': False,
+         'gift_card': True, 'taxable': False, 'tax_lines': [{'rate': 0.14}]},
+        {'order_id': order_id, 'platform_line_item_id': '2', 'quantity': 2, 'requires_shipping': None,
+         'gift_card': None, 'taxable': None, 'tax_lines': None},
+    ]
+
+    asyncio.run(replace_rows(None, LineItem.__table__, 'order_id', [order_id], rows, ['order_id', 'platform_line_item_id']))
+
+    assert connection.calls == [
+        ('execute', "DELETE FROM line_items WHERE order_id = ANY($1)", ([order_id],)),
+        ('copy', 'line_items', [
+            (order_id, '1', 1, False, True, False, '[{"rate":0.14}]'),
+            # None in a NOT NULL column gets the model's default, which COPY would not apply
+            (order_id, '2', 2, True, False, True, None),
+        ], ['order_id', 'platform_line_item_id', 'quantity', 'requires_shipping', 'gift_card', 'taxable', 'tax_lines']),
+    ]
+
+def test_replace_rows_adds_missing_default_columns(monkeypatch):
+    connection = FakeConnection()
+    use_connection(monkeypatch, connection)
+    order_id = uuid.uuid4()
+    rows = [{'order_id': order_id, 'platform_line_item_id': '1', 'quantity': 1}]
+
+    asyncio.run(replace_rows(None, LineItem.__table__, 'order_id', [order_id], rows, ['order_id', 'platform_line_item_id']))
+
+    copy = connection.calls[1]
+    assert copy[3] == ['order_id', 'platform_line_item_id', 'quantity', 'requires_shipping', 'gift_card', 'taxable']
+    assert copy[2] == [(order_id, '1', 1, True, False, True)]
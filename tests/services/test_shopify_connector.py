@@ -0,0 +1,116 @@
+import json
+import urllib.error
+import pytest
+import shopify
+from pyactiveresource.connection import ClientError, Response
+from app.services.platform_connector import shopify as shopify_connector
+from app.services.platform_connector.shopify import ShopifyConnector, _with_rest_rate_limit_retry
+
+def _client_error(code, headers=None):
+    error = ClientError()
+    error.code = code
+    error.response = Response(code, '', headers or {})
+    return error
+
+class FlakyRequest:
+    """Raises the given errors in turn, then returns 'page'"""
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'page'
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(shopify_connector.time, 'sleep', delays.append)
+    return delays
+
+def test_rest_rate_limit_retry_waits_for_retry_after(sleeps):
+    """Test that a 429 retries only that request, honouring Retry-After or backing off"""
+    request = FlakyRequest(_client_error(429, {'Retry-After': '2.0'}), _client_error(429))
+
+    assert _with_rest_rate_limit_retry(request, backoff=1.0) == 'page'
+    assert request.calls == 3
+    assert sleeps == [2.0, 2.0]
+
+def test_rest_rate_limit_retry_gives_up(sleeps):
+    """Test that the 429 is raised once the retries are used up"""
+    request = FlakyRequest(*[_client_error(429) for _ in range(3)])
+
+    with pytest.raises(ClientError):
+        _with_rest_rate_limit_retry(request, max_retries=2, backoff=1.0)
+    assert sleeps == [1.0, 2.0]
+
+def test_rest_rate_limit_retry_raises_other_errors(sleeps):
+    """Test that client errors other than 429 are not retried"""
+    request = FlakyRequest(_client_error(404))
+
+    with pytest.raises(ClientError):
+        _with_rest_rate_limit_retry(request)
+    assert request.calls == 1
+    assert sleeps == []
+
+THROTTLED = {
+    'errors': [{'message': 'Throttled', 'extensions': {'code': 'THROTTLED'}}],
+    'extensions': {'cost': {
+        'requestedQueryCost': 502,
+        'throttleStatus': {'maximumAvailable': 2000, 'currentlyAvailable': 2, 'restoreRate': 100},
+    }},
+}
+CUSTOMERS = {'data': {'customers': {'nodes': [], 'pageInfo': {'hasNextPage': False, 'endCursor': None}}}}
+
+def fake_graphql(monkeypatch, *responses):
+    """Make shopify.GraphQL().execute return (or raise) `responses` in turn; returns the executed queries"""
+    responses = list(responses)
+    queries = []
+
+    class FakeGraphQL:
+        def execute(self, query, variables=None):
+            queries.append(query)
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return json.dumps(response)
+
+    monkeypatch.setattr(shopify, 'GraphQL', FakeGraphQL)
+    return queries
+
+def _http_error(code, headers=None):
+    return urllib.error.HTTPError('https://test-store.myshopify.com/graphql.json', code, 'error', headers or {}, None)
+
+SESSION = shopify.Session('test-store.myshopify.com', ShopifyConnector.API_VERSION, 'token')
+
+def test_graphql_retries_throttled_queries(monkeypatch, sleeps):
+    """Test that a THROTTLED response is retried after the delay its cost telemetry asks for"""
+    queries = fake_graphql(monkeypatch, THROTTLED, CUSTOMERS)
+
+    assert ShopifyConnector()._execute_graphql(SESSION, 'query') == CUSTOMERS
+    assert len(queries) == 2
+    assert sleeps == [5.0]
+
+def test_graphql_retries_rate_limits_and_server_errors(monkeypatch, sleeps):
+    queries = fake_graphql(monkeypatch, _http_error(429, {'Retry-After': '3'}), _http_error(503), CUSTOMERS)
+
+    assert ShopifyConnector()._execute_graphql(SESSION, 'query', backoff=1.0) == CUSTOMERS
+    assert len(queries) == 3
+    assert sleeps == [3.0, 2.0]
+
+def test_graphql_raises_other_errors(monkeypatch, sleeps):
+    """Test that query errors and client errors fail right away, and throttling once retries run out"""
+    fake_graphql(monkeypatch, {'errors': [{'message': 'Field does not exist'}]})
+    with pytest.raises(Exception, match='Field does not exist'):
+        ShopifyConnector()._execute_graphql(SESSION, 'query')
+
+    fake_graphql(monkeypatch, _http_error(401))
+    with pytest.raises(urllib.error.HTTPError):
+        ShopifyConnector()._execute_graphql(SESSION, 'query')
+
+    fake_graphql(monkeypatch, THROTTLED, THROTTLED)
+    with pytest.raises(Exception, match='Throttled'):
+        ShopifyConnector()._execute_graphql(SESSION, 'query', max_retries=1)
+    assert sleeps == [5.0]
@@ -0,0 +1,32 @@
+from app.tasks.async_helper import celery_async_task
+
+attempts = []
+
+def _failed_permanently(exc, store_id):
+    return f"failed permanently for store {store_id}: {exc}"
+
+@celery_async_task(max_retries=2, default_retry_delay=0, on_max_retries=_failed_permanently)
+async def always_failing_task(self, store_id: str):
+    attempts.append(store_id)
+    raise RuntimeError("boom")
+
+@celery_async_task(max_retries=1, default_retry_delay=0)
+async def failing_task_without_handler(self):
+    raise RuntimeError("boom")
+
+def test_celery_async_task_retries_then_calls_on_max_retries():
+    """Test that a failing coroutine is retried max_retries times, then handled by on_max_retries"""
+    attempts.clear()
+    result = always_failing_task.apply(args=("store-1",))
+
+    # The first run plus max_retries retries
+    assert attempts == ["store-1"] * 3
+    assert result.successful()
+    assert result.get() == "failed permanently for store store-1: boom"
+
+def test_celery_async_task_without_handler_raises_after_retries():
+    """Test that without on_max_retries the original error fails the task"""
+    result = failing_task_without_handler.apply()
+
+    assert result.failed()
+    assert isinstance(result.result, RuntimeError)
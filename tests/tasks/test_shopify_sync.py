@@ -0,0 +1,245 @@
+import asyncio
+import uuid
+from datetime import datetime, timezone
+from redis.exceptions import RedisError
+from types import SimpleNamespace
+from sqlalchemy.dialects import postgresql
+from app.tasks import shopify_sync
+from app.tasks.shopify_sync import RecordFingerprints, SyncCache, SyncStore, _sync_inventory_levels, _sync_products
+
+# Test data
+TEST_STORE = SyncStore(
+    id=uuid.uuid4(),
+    access_token="shpat_12345abcde67890fghijk",
+    shop_domain="test-store.myshopify.com",
+    last_sync_at=None,
+    platform="shopify",
+    is_active=True
+)
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self.rows
+
+class FakeSession:
+    """Records the statements executed on it; every query returns `rows`"""
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.statements = []
+        self.added = []
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+        return FakeResult(self.rows)
+
+    def add(self, instance):
+        self.added.append(instance)
+
+    async def commit(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+class FakeInventoryConnector:
+    async def fetch_inventory_levels(self, access_token, shop_domain):
+        yield [{'inventory_item_id': 1, 'available': 5, 'location_id': 2}]
+
+    async def fetch_products_by_ids(self, access_token, shop_domain, platform_product_ids):
+        for platform_product_id in platform_product_ids:
+            if platform_product_id == 'broken':
+                yield platform_product_id, Exception("not found")
+            else:
+                yield platform_product_id, {'variants': [{'id': 10, 'inventory_item_id': 1}]}
+
+def test_sync_inventory_levels_queries_store_products():
+    """Test that the inventory pass builds and runs its products query for the store"""
+    db = FakeSession()
+    asyncio.run(_sync_inventory_levels(db, FakeInventoryConnector(), TEST_STORE))
+
+    # Errors in the inventory pass are only logged, so check the query was actually reached
+    assert len(db.statements) == 1
+    compiled = db.statements[0].compile(dialect=postgresql.dialect())
+    assert "products.store_id = %(store_id_1)s" in str(compiled)
+    assert compiled.params == {'store_id_1': TEST_STORE.id}
+
+def test_sync_inventory_levels_updates_products():
+    """Test that variant inventory is attached to products, skipping products that fail to fetch"""
+    product = SimpleNamespace(platform_product_id='100', inventory_levels=None)
+    broken = SimpleNamespace(platform_product_id='broken', inventory_levels=None)
+    db = FakeSession([product, broken])
+    asyncio.run(_sync_inventory_levels(db, FakeInventoryConnector(), TEST_STORE))
+
+    assert product.inventory_levels == {'10': {'available': 5, 'location_id': 2}}
+    assert broken.inventory_levels is None
+    assert db.added == [product]
+
+def test_sync_products_signals_done_before_inventory(monkeypatch):
+    """Test that the orders stream is released once products are written, not after the inventory pass"""
+    done = asyncio.Event()
+    inventory_calls = []
+
+    async def write_batches(batches, write_batch):
+        pass
+
+    async def sync_inventory_levels(db, connector, store):
+        inventory_calls.append(done.is_set())
+
+    monkeypatch.setattr(shopify_sync, '_write_batches_concurrently', write_batches)
+    monkeypatch.setattr(shopify_sync, '_sync_inventory_levels', sync_inventory_levels)
+    monkeypatch.setattr(shopify_sync, 'AsyncSessionLocal', FakeSession)
+    connector = SimpleNamespace(fetch_products_concurrent=lambda **kwargs: None)
+
+    asyncio.run(_sync_products(TEST_STORE, connector, None, SyncCache(), done, sync_inventory=True))
+
+    assert inventory_calls == [True]
+
+class FakeRedis:
+    """The hash commands RecordFingerprints uses, over in-memory dicts; values come back as bytes"""
+    def __init__(self):
+        self.hashes = {}
+        self.ttls = {}
+
+    async def hmget(self, key, fields):
+        values = self.hashes.get(key, {})
+        return [values.get(field) for field in fields]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    def hset(self, key, mapping):
+        self.commands.append(lambda: self.redis.hashes.setdefault(key, {}).update(
+            {field: value.encode() for field, value in mapping.items()}
+        ))
+
+    def expire(self, key, ttl):
+        self.commands.append(lambda: self.redis.ttls.__setitem__(key, ttl))
+
+    async def execute(self):
+        for command in self.commands:
+            command()
+
+class FailingRedis(FakeRedis):
+    async def hmget(self, key, fields):
+        raise RedisError("connection refused")
+
+UPDATED_AT = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+LATER = datetime(2024, 5, 2, 12, 0, tzinfo=timezone.utc)
+
+def test_record_fingerprints_drop_unchanged():
+    """Test that only rows whose platform_updated_at changed since `remember` are kept"""
+    redis = FakeRedis()
+    fingerprints = RecordFingerprints(redis, TEST_STORE.id)
+    rows = [
+        {'platform_order_id': '1', 'platform_updated_at': UPDATED_AT},
+        {'platform_order_id': '2', 'platform_updated_at': UPDATED_AT},
+    ]
+
+    async def run():
+        # Nothing remembered yet: every row is written
+        changed, seen = await fingerprints.drop_unchanged('orders', rows, 'platform_order_id')
+        assert changed == rows
+        await fingerprints.remember('orders', seen)
+
+        # Re-delivered: order 2 changed, order 1 didn't; rows without updated_at are always written
+        redelivered = [
+            {'platform_order_id': '1', 'platform_updated_at': UPDATED_AT},
+            {'platform_order_id': '2', 'platform_updated_at': LATER},
+            {'platform_order_id': '3', 'platform_updated_at': None},
+        ]
+        changed, seen = await fingerprints.drop_unchanged('orders', redelivered, 'platform_order_id')
+        assert changed == redelivered[1:]
+        assert seen == {'2': LATER.isoformat()}
+        await fingerprints.remember('orders', seen)
+
+    asyncio.run(run())
+
+    # One field per record, overwritten in place
+    key = f"store:{TEST_STORE.id}:orders_fp"
+    assert redis.hashes[key] == {'1': UPDATED_AT.isoformat().encode(), '2': LATER.isoformat().encode()}
+    assert redis.ttls[key] == RecordFingerprints.TTL
+
+def test_record_fingerprints_redis_errors_write_everything():
+    """Test that a failed fingerprint lookup skips no rows"""
+    fingerprints = RecordFingerprints(FailingRedis(), TEST_STORE.id)
+    rows = [{'platform_order_id': '1', 'platform_updated_at': UPDATED_AT}]
+
+    changed, seen = asyncio.run(fingerprints.drop_unchanged('orders', rows, 'platform_order_id'))
+
+    assert changed == rows
+    assert seen == {}
+
+def test_fingerprint_redis_falls_back_without_redis_url(monkeypatch):
+    """Test that a non-Redis cache URL disables fingerprints instead of failing the sync"""
+    monkeypatch.setenv('SYNC_CACHE_URL', 'amqp://guest@localhost//')
+
+    assert shopify_sync._fingerprint_redis(TEST_STORE.id) is None
+
+class FakeOrdersConnector:
+    def __init__(self, orders):
+        self.orders = orders
+
+    async def fetch_orders_concurrent(self, access_token, shop_domain, since):
+        yield self.orders
+
+    def map_order_to_db_model(self, order):
+        return {
+            'platform_order_id': str(order['id']),
+            'platform_customer_id': str(order['customer']['id']) if order.get('customer') else None,
+            'platform_updated_at': UPDATED_AT,
+        }
+
+    def map_line_item_to_db_model(self, item):
+        return {'platform_line_item_id': str(item['id']), 'platform_product_id': str(item['product_id'])}
+
+def test_sync_orders_does_not_fingerprint_unresolved_orders(monkeypatch):
+    """Test that orders written with a missing customer or product are rewritten by the next sync"""
+    orders = [
+        {'id': 1, 'customer': {'id': 10}, 'line_items': [{'id': 100, 'product_id': 20}]},
+        {'id': 2, 'customer': {'id': 11}, 'line_items': [{'id': 101, 'product_id': 20}]},
+        {'id': 3, 'customer': {'id': 10}, 'line_items': [{'id': 102, 'product_id': 21}]},
+    ]
+    upserted = []
+
+    async def get_customer_ids(db, store_id, ids):
+        return {'10': uuid.uuid4()}
+
+    async def get_product_ids(db, store_id, ids):
+        return {'20': uuid.uuid4()}
+
+    async def upsert_orders(db, orders_rows, product_ids, missing_products=None):
+        upserted.extend(row['platform_order_id'] for row in orders_rows)
+        return {}
+
+    monkeypatch.setattr(shopify_sync, 'AsyncSessionLocal', FakeSession)
+    monkeypatch.setattr(shopify_sync, 'get_customer_ids_by_platform_ids', get_customer_ids)
+    monkeypatch.setattr(shopify_sync, 'get_product_ids_by_platform_ids', get_product_ids)
+    monkeypatch.setattr(shopify_sync, 'upsert_orders', upsert_orders)
+    redis = FakeRedis()
+    fingerprints = RecordFingerprints(redis, TEST_STORE.id)
+
+    asyncio.run(shopify_sync._sync_orders(TEST_STORE, FakeOrdersConnector(orders), None, SyncCache(), [], fingerprints=fingerprints))
+
+    # Order 2 misses its customer and order 3 its product: both are written but not remembered
+    assert upserted == ['1', '2', '3']
+    assert redis.hashes[f"store:{TEST_STORE.id}:orders_fp"] == {'1': UPDATED_AT.isoformat().encode()}